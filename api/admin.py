@@ -1,6 +1,7 @@
 from django.contrib import admin
-from api.models import TaskModel
+from api.models import TaskModel, Job
 # Register your models here.
 
 
 admin.site.register(TaskModel)
+admin.site.register(Job)   # failed jobs keep their traceback in last_error
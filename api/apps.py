@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from api import authentication  # noqa: F401  connects the user state receivers
+        from api import caching  # noqa: F401  connects the cache invalidation receivers
+        from api import checks  # noqa: F401  registers the system checks
+        from api import stats  # noqa: F401  connects the summary table receiver
+        from api import sync  # noqa: F401  connects the change log receiver
+        from api import tokens  # noqa: F401  connects the blacklist cache receiver
@@ -0,0 +1,226 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.authentication import CachedJWTAuthentication
+from api.bulk import parse_id
+from api.filters import filter_tasks
+from api.models import User, TaskModel
+from api.ownership import adelete_task, amissing_task, scoped_tasks
+from api.serializers import LeanTaskSerializer, TaskBulkSerializer, TaskSerializer
+from api.throttling import throttle_wait
+from api.views import TaskCursorPagination, TaskPagination
+
+
+# async counterparts of the task CRUD/list views for ASGI deployments. DRF views are sync
+# only, so these are plain Django async views doing the same authentication, throttling,
+# ownership checks and validation with the async ORM, no request ever waits on a worker thread
+# for a read. model saves/deletes still go through TaskModel.save/delete, which the
+# async ORM runs in a thread, so the tasks_changed receivers keep working
+
+
+class AsyncTaskView(View):
+
+  authentication = CachedJWTAuthentication()
+  throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES   # the same budgets as the DRF task views
+
+  @classonlymethod
+  def as_view(cls, **initkwargs):
+    view = super().as_view(**initkwargs)
+    view.csrf_exempt = True   # token authenticated like the DRF views, no session cookies involved
+    return view
+
+
+  async def dispatch(self, request, *args, **kwargs):
+    try:
+      authenticated = await self.authentication.aauthenticate(request)
+    except APIException as e:
+      return self.error_response(e)
+
+    if authenticated is None:
+      return JsonResponse({"detail":"Authentication credentials were not provided."}, status=401)
+
+    request.user, request.auth = authenticated
+    request.query_params = request.GET   # lets the helpers shared with the DRF views read the query string
+
+    wait = await sync_to_async(throttle_wait, thread_sensitive=False)(request, self)   # cache calls only
+    if wait is not None:
+      return self.error_response(Throttled(wait))
+
+    try:
+      return await super().dispatch(request, *args, **kwargs)
+    except APIException as e:
+      return self.error_response(e)
+
+
+  def error_response(self, exc):   # what DRF's exception handler would have answered
+    detail = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail":exc.detail}
+    response = JsonResponse(detail, status=exc.status_code, safe=False)
+    if getattr(exc, 'wait', None):
+      response['Retry-After'] = f"{exc.wait:.0f}"
+    return response
+
+
+  def request_data(self, request):
+    try:
+      return json.loads(request.body or b'{}')
+    except ValueError:
+      return None
+
+
+  async def owner_id_for(self, request, data):
+    # same rules as TaskSerializer._get_owner_id, returns None for an unknown owner
+    if request.user.is_staff and data.get('owner'):
+      owner_id = parse_id(data.get('owner'))
+      if owner_id is None or not await User.objects.filter(id=owner_id).aexists():
+        return None
+      return owner_id
+
+    return request.user.id
+
+
+  async def get_task(self, request, id):
+    # returns (task, None) or (None, error response)
+    task = await scoped_tasks(request.user, id).afirst()
+    if not task:
+      return None, await self.missing(request, id)
+
+    return task, None
+
+
+  async def missing(self, request, id):
+    code, body = await amissing_task(request.user, id)
+    return JsonResponse(body, status=code)
+
+
+
+class AsyncCreateTaskView(AsyncTaskView):
+
+  async def post(self, request):
+    data = self.request_data(request)
+    serializer = TaskBulkSerializer(data=data)
+    if not serializer.is_valid():
+      return JsonResponse(serializer.errors, status=400)
+
+    owner_id = await self.owner_id_for(request, data)
+    if owner_id is None:
+      return JsonResponse({"owner":["User with this ID does not exist"]}, status=400)
+
+    if await TaskModel.objects.filter(title=serializer.validated_data['title'], owner_id=owner_id).aexists():
+      return JsonResponse({"title":["A task with the same title already exists"]}, status=400)
+
+    try:
+      task = await TaskModel.objects.acreate(owner_id=owner_id, **serializer.validated_data)
+    except IntegrityError:
+      return JsonResponse({"detail":"You already have a task with this title"}, status=400)
+
+    return JsonResponse(TaskSerializer(task).data, status=201)
+
+
+
+class AsyncListTaskView(AsyncTaskView):
+
+  async def get(self, request):
+    tasks = filter_tasks(request)
+
+    serializer = LeanTaskSerializer.from_request(request)
+    rows = serializer.rows(tasks)
+
+    if request.GET.get('pagination') == 'cursor':
+      paginator = TaskCursorPagination()
+      page = await paginator.apaginate_queryset(rows, request)
+      if not page:
+        return JsonResponse({"message":"No tasks found", "data":[]})
+
+      return JsonResponse({"next":paginator.get_next_link(),
+                           "results":serializer.to_representation(page)
+                          })
+
+    page_size = TaskPagination().get_page_size(request)
+    page_number = parse_id(request.GET.get('page', 1))
+
+    count = await tasks.acount()
+    if not count:
+      return JsonResponse({"message":"No tasks found", "data":[]})
+
+    last_page = (count + page_size - 1) // page_size
+    if page_number is None or not 1 <= page_number <= last_page:
+      return JsonResponse({"detail":"Invalid page."}, status=404)
+
+    start = (page_number - 1) * page_size
+    page  = [row async for row in rows[start:start + page_size]]
+
+    url = request.build_absolute_uri()
+    return JsonResponse({"count":count,
+                         "next":replace_query_param(url, 'page', page_number + 1) if page_number < last_page else None,
+                         "previous":(remove_query_param(url, 'page') if page_number == 2 else replace_query_param(url, 'page', page_number - 1)) if page_number > 1 else None,
+                         "results":serializer.to_representation(page)
+                        })
+
+
+
+class AsyncRetrieveTaskView(AsyncTaskView):
+
+  async def get(self, request, id):
+    task, error = await self.get_task(request, id)
+    if error:
+      return error
+
+    return JsonResponse(TaskSerializer(task).data)
+
+
+
+class AsyncUpdateTaskView(AsyncTaskView):
+
+  async def put(self, request, id):
+    task, error = await self.get_task(request, id)
+    if error:
+      return error
+
+    data = self.request_data(request)
+    serializer = TaskBulkSerializer(task, data=data, partial=True)
+    if not serializer.is_valid():
+      return JsonResponse(serializer.errors, status=400)
+
+    owner_id = task.owner_id
+    if request.user.is_staff and 'owner' in data:
+      owner_id = await self.owner_id_for(request, data)
+      if owner_id is None:
+        return JsonResponse({"owner":["User with this ID does not exist"]}, status=400)
+
+    title = serializer.validated_data.get('title', task.title)
+    changes_key = title != task.title or owner_id != task.owner_id   # a PUT resending the task needs no check
+    if changes_key and await TaskModel.objects.filter(title=title, owner_id=owner_id).exclude(id=task.id).aexists():
+      return JsonResponse({"title":["A task with the same title already exists"]}, status=400)
+
+    update_fields = [*serializer.validated_data, 'updated_at']   # only the columns the request sent
+    if owner_id != task.owner_id:
+      update_fields.append('owner_id')
+
+    for attr, value in serializer.validated_data.items():
+      setattr(task, attr, value)
+    task.owner_id = owner_id
+
+    try:
+      await task.asave(update_fields=update_fields)
+    except IntegrityError:
+      return JsonResponse({"detail":"You already have a task with this title"}, status=400)
+
+    return JsonResponse(TaskSerializer(task).data)
+
+
+
+class AsyncDeleteTaskView(AsyncTaskView):
+
+  async def delete(self, request, id):
+    if await adelete_task(request.user, id) is None:
+      return await self.missing(request, id)
+
+    return HttpResponse(status=204)
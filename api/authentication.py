@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from api.models import User
+
+
+# JWT authentication that trusts the token claims instead of loading the user row on
+# every request. the only database read left is the account state (active/staff), cached
+# for AUTH_USER_STATE_TIMEOUT seconds and dropped as soon as the user is saved. that takes a
+# cache every process shares (api.checks refuses local memory).
+#
+# without REDIS_URL the timeout defaults to 0, and every authenticated request still runs one
+# query on the user table, two columns by primary key instead of the whole row. that is on
+# purpose: a deactivated or demoted user is refused at once, not when the token expires
+
+
+_INACTIVE = {"is_active":False, "is_staff":False}   # how a deleted user is remembered
+
+
+def _state_key(user_id):
+  return f"auth:user:{user_id}"
+
+
+
+def get_user_state(user_id):
+  state = cache.get(_state_key(user_id)) if settings.AUTH_USER_STATE_TIMEOUT else None
+
+  if state is None:
+    state = User.objects.filter(id=user_id).values('is_active','is_staff').first() or _INACTIVE
+    if settings.AUTH_USER_STATE_TIMEOUT:
+      cache.set(_state_key(user_id), state, settings.AUTH_USER_STATE_TIMEOUT)
+
+  return state
+
+
+
+async def aget_user_state(user_id):
+  state = await cache.aget(_state_key(user_id)) if settings.AUTH_USER_STATE_TIMEOUT else None
+
+  if state is None:
+    state = await User.objects.filter(id=user_id).values('is_active','is_staff').afirst() or _INACTIVE
+    if settings.AUTH_USER_STATE_TIMEOUT:
+      await cache.aset(_state_key(user_id), state, settings.AUTH_USER_STATE_TIMEOUT)
+
+  return state
+
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_state(sender, instance, **kwargs):
+  cache.delete(_state_key(instance.id))
+
+
+
+class TaskTokenUser(TokenUser):
+  # request.user for token authenticated requests. staff rights need both the claim and
+  # the current account state, so a demoted user loses them without waiting for the token to expire
+
+  def __init__(self, token, state):
+    super().__init__(token)
+    self.state = state
+
+  @cached_property
+  def id(self):
+    return int(self.token[api_settings.USER_ID_CLAIM])   # simplejwt stores the id claim as a string
+
+  @cached_property
+  def pk(self):
+    return self.id
+
+  @property
+  def is_active(self):
+    return self.token.get('is_active', True) and self.state['is_active']
+
+  @property
+  def is_staff(self):
+    return self.token.get('is_staff', False) and self.state['is_staff']
+
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+  def get_user(self, validated_token):
+    try:
+      user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+    except (KeyError, TypeError, ValueError):
+      raise InvalidToken("Token contained no recognizable user identification")
+
+    return self.check_active(TaskTokenUser(validated_token, get_user_state(user_id)))
+
+
+  async def aauthenticate(self, request):
+    # for the async views, token checks are CPU only and the account state comes from the async cache/ORM
+    header = self.get_header(request)
+    if header is None:
+      return None
+
+    raw_token = self.get_raw_token(header)
+    if raw_token is None:
+      return None
+
+    validated_token = self.get_validated_token(raw_token)
+    try:
+      user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+    except (KeyError, TypeError, ValueError):
+      raise InvalidToken("Token contained no recognizable user identification")
+
+    return self.check_active(TaskTokenUser(validated_token, await aget_user_state(user_id))), validated_token
+
+
+  def check_active(self, user):
+    if not user.is_active:
+      raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+    return user
@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db import connections, router
+from api.models import User, TaskModel
+
+
+# set based helpers shared by the bulk task views. every helper answers for a whole
+# batch with at most one query, instead of one query per task
+
+
+class BulkRequestError(Exception):
+  pass
+
+
+
+def check_batch_size(items):
+  max_items = settings.TASK_BULK_MAX_ITEMS
+
+  if not isinstance(items, list) or not items:
+    raise BulkRequestError("Expected a non-empty list")
+
+  if len(items) > max_items:
+    raise BulkRequestError(f"At most {max_items} items are allowed per request")
+
+
+
+def parse_id(value):   # ids arrive straight from the request body, so they may be anything
+  if isinstance(value, bool):
+    return None
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return None
+
+
+
+def requested_owner_id(request, item):
+  # same rules as TaskSerializer._get_owner_id, staff may pick an owner, everyone else owns what they write
+  if request.user.is_staff and item.get('owner'):
+    return parse_id(item.get('owner'))
+
+  return request.user.id
+
+
+
+def existing_owner_ids(owner_ids):
+  owner_ids = {owner_id for owner_id in owner_ids if owner_id is not None}
+  if not owner_ids:
+    return set()
+
+  return set(User.objects.filter(id__in=owner_ids).values_list('id', flat=True))
+
+
+
+def existing_titles(pairs):
+  # maps every (owner_id, title) pair of the batch that is already taken to the id of the task holding it
+  pairs = set(pairs)
+  if not pairs:
+    return {}
+
+  owner_ids = {owner_id for owner_id, title in pairs}
+  titles    = {title for owner_id, title in pairs}
+
+  rows = TaskModel.objects.filter(owner_id__in=owner_ids, title__in=titles).values_list('owner_id','title','id')
+
+  return {(owner_id, title): task_id for owner_id, title, task_id in rows if (owner_id, title) in pairs}
+
+
+
+def delete_tasks(task_ids):
+  # one DELETE ... WHERE id IN (...) RETURNING, nothing points at tasks so the cascade collector
+  # has nothing to do. maps every deleted task's id to (owner_id, status, due_date)
+  alias      = router.db_for_write(TaskModel)
+  quote_name = connections[alias].ops.quote_name
+
+  columns = ", ".join(quote_name(column) for column in ('id','owner_id','status','due_date'))
+  sql = (f"DELETE FROM {quote_name(TaskModel._meta.db_table)} WHERE {quote_name('id')} IN ({', '.join(['%s'] * len(task_ids))}) "
+         f"RETURNING {columns}")
+
+  return {task.id:task.counted_bucket() for task in TaskModel.objects.db_manager(alias).raw(sql, list(task_ids))}   # raw() converts the returned columns
@@ -0,0 +1,132 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.conditional import conditional_response, normalized_path, set_validators
+from api.signals import tasks_changed
+
+
+# read-through cache for task responses.
+#
+# every cache scope (one per user, plus one shared by all staff) has a version number
+# that is part of every key cached for it. writes bump the versions of the owners they
+# touch and the staff version, so stale entries are never read again and simply expire.
+
+STAFF_SCOPE = 'staff'
+
+
+
+def shared_cache():
+  # true unless the default cache is the per process local memory one
+  return not settings.CACHES['default']['BACKEND'].endswith('LocMemCache')
+
+
+def _version_key(scope):
+  return f"tasks:version:{scope}"
+
+
+
+def _fresh_version():
+  # versions restart from the clock, so a version key lost to eviction never comes back as an old number
+  return int(time.time() * 1000)
+
+
+
+def get_version(scope):
+  version = cache.get(_version_key(scope))
+
+  if version is None:
+    cache.add(_version_key(scope), _fresh_version(), timeout=None)
+    version = cache.get(_version_key(scope))
+
+  return version
+
+
+
+def bump_versions(scopes):
+  for scope in scopes:
+    try:
+      cache.incr(_version_key(scope))
+    except ValueError:
+      cache.set(_version_key(scope), _fresh_version(), timeout=None)
+
+
+
+def count(event):   # hit/miss counters, readable with get_counters()
+  try:
+    cache.incr(f"tasks:counter:{event}")
+  except ValueError:
+    cache.add(f"tasks:counter:{event}", 1, timeout=None)
+
+
+
+def get_counters():
+  counters = cache.get_many(["tasks:counter:hit", "tasks:counter:miss"])
+  return {"hit":counters.get("tasks:counter:hit", 0), "miss":counters.get("tasks:counter:miss", 0)}
+
+
+
+def response_key(request):
+  scope  = STAFF_SCOPE if request.user.is_staff else request.user.id
+  digest = hashlib.md5(normalized_path(request).encode()).hexdigest()
+
+  return f"tasks:response:{scope}:{get_version(scope)}:{digest}"
+
+
+
+def cache_task_response(method):
+  # wraps the get() of a task view. 200 responses are cached per user, per path and per
+  # query string together with the ETag/Last-Modified the view set, so a conditional
+  # request against a cached entry is answered without touching the database.
+  # TASK_CACHE_TIMEOUT=0 (the default without a shared cache) leaves get() as it is
+
+  @wraps(method)
+  def wrapper(view, request, *args, **kwargs):
+    if not settings.TASK_CACHE_TIMEOUT:
+      return method(view, request, *args, **kwargs)
+
+    key   = response_key(request)
+    entry = cache.get(key)
+
+    if entry is not None:
+      count("hit")
+      response = conditional_response(request, entry['etag'], entry['last_modified'])
+      if response is None:
+        response = set_validators(Response(entry['data'], status=status.HTTP_200_OK), entry['etag'], entry['last_modified'])
+      response['X-Cache'] = "HIT"
+
+    else:
+      count("miss")
+      response = method(view, request, *args, **kwargs)
+      response['X-Cache'] = "MISS"
+
+      if response.status_code == status.HTTP_200_OK and getattr(response, 'validators', None):
+        etag, last_modified = response.validators
+        cache.set(key, {"data":response.data, "etag":etag, "last_modified":last_modified}, settings.TASK_CACHE_TIMEOUT)
+
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+  return wrapper
+
+
+
+@receiver(tasks_changed)
+def invalidate_task_responses(sender, changes, **kwargs):
+  if not settings.TASK_CACHE_TIMEOUT:
+    return
+
+  scopes = {owner_id for action, task_id, owner_id in changes}
+  scopes.add(STAFF_SCOPE)
+
+  # bumped after commit, a reader in between would otherwise cache the old rows under the new version
+  transaction.on_commit(lambda: bump_versions(scopes))
+
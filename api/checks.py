@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from api.caching import shared_cache
+
+
+# settings whose cache entries one process writes and every other process has to see:
+# (setting, how to do without the shared cache)
+SHARED_CACHE_SETTINGS = (("AUTH_USER_STATE_TIMEOUT", "Set AUTH_USER_STATE_TIMEOUT=0 to read the account state on every request."),
+                         ("TASK_CACHE_TIMEOUT", "Set TASK_CACHE_TIMEOUT=0 to turn the task response cache off."),
+                         ("DATABASE_REPLICAS", "Leave DATABASE_REPLICA_HOSTS empty to read from the primary only."),
+                        )
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+  # the account state and the task responses are dropped from the cache by the process that
+  # writes, and the replica pin is set by the process that served the write. every other
+  # process would keep its own local memory copy, or never see the pin
+  if shared_cache():
+    return []
+
+  return [Error(f"{name} needs a cache shared between processes",
+                hint=f"Set REDIS_URL. {without}",
+                id='api.E001',
+               )
+          for name, without in SHARED_CACHE_SETTINGS
+          if getattr(settings, name)
+         ]
@@ -0,0 +1,81 @@
+import hashlib
+from calendar import timegm
+from urllib.parse import urlencode
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+# ETag/Last-Modified validators for task responses, all derived from updated_at so
+# they can be checked without serializing anything. lists carry only the ETag
+
+
+def normalized_path(request):   # same filters in any order give the same path
+  params = urlencode(sorted(request.query_params.lists()), doseq=True)
+
+  if 'overdue' in request.query_params:   # the same overdue query matches other tasks tomorrow
+    return f"{request.path}?{params}#{timezone.localdate().isoformat()}"
+
+  return f"{request.path}?{params}"
+
+
+
+def task_validators(task):
+  etag = f'"{task.id}-{task.updated_at.timestamp():.6f}"'
+  return etag, task.updated_at
+
+
+
+def list_summary(tasks):
+  # one aggregate over the filtered tasks, any write to them moves either the count or the latest updated_at
+  return tasks.order_by().aggregate(last_modified=Max('updated_at'), count=Count('id'))
+
+
+
+def page_summary(page, has_next):
+  # for cursor pages (values() rows), which never count the whole list. the ids catch a row leaving the page
+  return {"count":len(page),
+          "last_modified":max((row['updated_at'] for row in page), default=None),
+          "ids":[row['id'] for row in page],
+          "has_next":has_next
+         }
+
+
+
+def list_validators(request, summary):
+  # no Last-Modified: deleting a task leaves the latest updated_at where it was, so If-Modified-Since
+  # would answer 304 for a list that lost a row. the ETag covers the count as well
+  scope  = 'staff' if request.user.is_staff else request.user.id
+  digest = hashlib.md5(f"{scope}|{normalized_path(request)}|{sorted(summary.items())}".encode()).hexdigest()
+
+  return f'"{digest}"', None
+
+
+
+def conditional_response(request, etag, last_modified):
+  # 304 when If-None-Match/If-Modified-Since still hold, 412 when If-Match/If-Unmodified-Since
+  # fail, None when the request should go ahead
+  timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+
+  response = get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+  if response is None:
+    return None
+
+  if response.status_code == status.HTTP_304_NOT_MODIFIED:
+    return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+  return Response({"message":"Task was modified since it was last read"}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+
+
+def set_validators(response, etag, last_modified):
+  response['ETag'] = etag
+  if last_modified:
+    response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+
+  response.validators = (etag, last_modified)   # kept for the response cache
+  return response
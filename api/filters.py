@@ -0,0 +1,127 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import PermissionDenied
+from api.models import TaskModel, TASK_SEARCH_CONFIG
+
+
+# query parameter filtering shared by every endpoint that lists tasks
+
+ORDERING_FIELDS = ['due_date','created_at','updated_at','title','status']
+
+MAX_OWNER_IDS = 100
+
+
+class CommaSeparatedIdsField(serializers.Field):
+
+  default_error_messages = {'invalid':"Expected a comma separated list of ids",
+                            'max_length':"At most {max_length} ids are allowed"
+                           }
+
+  def to_internal_value(self, data):
+    try:
+      ids = [int(value) for value in str(data).split(',') if value.strip()]
+    except ValueError:
+      self.fail('invalid')
+
+    if not ids:
+      self.fail('invalid')
+    if len(ids) > MAX_OWNER_IDS:
+      self.fail('max_length', max_length=MAX_OWNER_IDS)
+
+    return ids
+
+
+
+class TaskFilterSerializer(serializers.Serializer):
+  # every filter is parsed here before any query is built, bad values end in a 400 naming the parameter
+
+  invalid_date     = {'invalid':"Invalid date format. Use YYYY-MM-DD"}
+  invalid_datetime = {'invalid':"Invalid datetime format. Use ISO 8601, e.g. 2025-12-31T18:30:00Z"}
+
+  owner           = serializers.IntegerField(required=False)
+  owner__in       = CommaSeparatedIdsField(required=False)
+  due_date        = serializers.DateField(required=False, error_messages=invalid_date)
+  due_date__gte   = serializers.DateField(required=False, error_messages=invalid_date)
+  due_date__lte   = serializers.DateField(required=False, error_messages=invalid_date)
+  created_at__gte = serializers.DateTimeField(required=False, error_messages=invalid_datetime)
+  created_at__lte = serializers.DateTimeField(required=False, error_messages=invalid_datetime)
+  overdue         = serializers.BooleanField(required=False, allow_null=True, default=None)
+  ordering        = serializers.CharField(required=False)
+
+
+  def validate_ordering(self, value):
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+
+    for field in fields:
+      if field.lstrip('-') not in ORDERING_FIELDS:
+        raise serializers.ValidationError(f"Cannot order by '{field}'. Use {', '.join(ORDERING_FIELDS)}, prefixed with '-' for descending")
+
+    if fields and self.initial_data.get('pagination') == 'cursor':
+      raise serializers.ValidationError("Cursor pagination always lists the newest tasks first")
+
+    return fields
+
+
+
+def filter_tasks(request):
+  # tasks visible to the requesting user, narrowed down by the query params
+
+  if not request.user.is_staff and ('owner' in request.query_params or 'owner__in' in request.query_params):
+    raise PermissionDenied({"message":"Request not allowed"})
+
+  params = TaskFilterSerializer(data=request.query_params)
+  params.is_valid(raise_exception=True)
+  filters = params.validated_data
+
+  tasks = TaskModel.objects.visible_to(request.user)
+
+  task_status = request.query_params.get('status')
+  if task_status is not None:
+    if task_status.lower() == "true":
+      tasks = tasks.filter(status=True)
+
+    elif task_status.lower() == "false":
+      tasks = tasks.filter(status=False)
+
+
+  if 'owner' in filters:
+    tasks = tasks.filter(owner_id=filters['owner'])
+
+  if 'owner__in' in filters:
+    tasks = tasks.filter(owner_id__in=filters['owner__in'])
+
+  # plain column comparisons, each one can use the (owner, status, due_date), due_date and created_at indexes
+  for lookup in ['due_date','due_date__gte','due_date__lte','created_at__gte','created_at__lte']:
+    if lookup in filters:
+      tasks = tasks.filter(**{lookup:filters[lookup]})
+
+  if filters['overdue'] is not None:
+    overdue = Q(status=False, due_date__lt=timezone.localdate())
+    tasks = tasks.filter(overdue) if filters['overdue'] else tasks.exclude(overdue)
+
+  search = request.query_params.get('q', '').strip()
+  if search:
+    tasks = search_tasks(tasks, search)
+
+  if filters.get('ordering'):
+    # id keeps pages stable between equal values, in the direction of the last field so an index on (field, id) reads either way
+    tie_break = '-id' if filters['ordering'][-1].startswith('-') else 'id'
+    tasks = tasks.order_by(*filters['ordering'], tie_break)
+  elif not search:
+    tasks = tasks.order_by('-created_at','-id')   # newest first, the order cursor pages come in as well
+
+  return tasks
+
+
+
+def search_tasks(tasks, search):
+  # best matches first. postgres answers from the GIN index on search_vector, other
+  # databases (sqlite test runs) fall back to a substring match, newest first
+  if connections[tasks.db].vendor == 'postgresql':
+    query = SearchQuery(search, search_type='websearch', config=TASK_SEARCH_CONFIG)
+    return tasks.filter(search_vector=query).order_by(SearchRank(F('search_vector'), query).desc(), '-created_at', '-id')
+
+  return tasks.filter(Q(title__icontains=search) | Q(description__icontains=search)).order_by('-created_at', '-id')
@@ -0,0 +1,59 @@
+import math
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+# password hashers with their costs taken from the settings. django rehashes a stored
+# password on the user's next successful login when its algorithm isn't the first one in
+# PASSWORD_HASHERS or its costs differ from these, so changing either needs no migration
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+
+  def __init__(self):
+    self.time_cost   = settings.PASSWORD_ARGON2_TIME_COST
+    self.memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST   # KiB
+    self.parallelism = settings.PASSWORD_ARGON2_PARALLELISM
+
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+
+  def __init__(self):
+    self.work_factor = settings.PASSWORD_SCRYPT_WORK_FACTOR
+    self.block_size  = settings.PASSWORD_SCRYPT_BLOCK_SIZE
+    self.parallelism = settings.PASSWORD_SCRYPT_PARALLELISM
+    self.maxmem      = 256 * self.work_factor * self.block_size   # twice what scrypt needs, openssl stops at 32 MiB otherwise
+
+
+
+class PasswordHashingBusy(APIException):
+  status_code    = status.HTTP_503_SERVICE_UNAVAILABLE
+  default_detail = "Too many sign-ins in progress, try again shortly."
+  default_code   = 'password_hashing_busy'
+
+  def __init__(self, wait):
+    super().__init__()
+    self.wait = wait   # sent as Retry-After
+
+
+
+_password_slots = threading.BoundedSemaphore(settings.PASSWORD_HASHING_CONCURRENCY)
+
+
+@contextmanager
+def password_slot():
+  # at most PASSWORD_HASHING_CONCURRENCY hashes run at once per process, so a login peak
+  # leaves the cpu to the task endpoints. whoever can't get a slot within
+  # PASSWORD_HASHING_TIMEOUT seconds gets a 503 instead of queueing forever
+  if not _password_slots.acquire(timeout=settings.PASSWORD_HASHING_TIMEOUT):
+    raise PasswordHashingBusy(max(1, math.ceil(settings.PASSWORD_HASHING_TIMEOUT)))
+  try:
+    yield
+  finally:
+    _password_slots.release()
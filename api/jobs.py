@@ -0,0 +1,207 @@
+import logging
+import time
+import traceback
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api.management.commands.prune_tokens import prune_expired_tokens
+from api.models import Job, JobSchedule, TaskModel, User
+from api.stats import rebuild_summary
+from api.sync import prune_changes
+
+
+# background jobs on a database table, no broker needed. workers (`manage.py run_jobs`) take
+# one due job at a time with SELECT ... FOR UPDATE SKIP LOCKED and mark it running with an
+# UPDATE conditional on what they read, so two workers never run the same job, also on
+# sqlite where the lock clause doesn't exist. a failing job is retried with exponential
+# backoff until max_attempts and then left as failed, a job stuck in running for
+# JOB_TIMEOUT seconds is taken to belong to a dead worker and run again.
+# settings.JOB_SCHEDULES enqueues jobs periodically, each run once whatever the number of workers
+
+logger = logging.getLogger('api.jobs')
+
+JOBS = {}
+
+
+def job(name):   # registers the function as job `name`, it is called with the payload as keyword arguments
+  def register(function):
+    JOBS[name] = function
+    return function
+  return register
+
+
+
+def enqueue(name, payload=None, run_at=None, max_attempts=None):
+  if name not in JOBS:
+    raise ValueError(f"No job called {name!r} is registered")
+
+  return Job.objects.create(name=name, payload=payload or {}, run_at=run_at or timezone.now(),
+                            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+
+
+
+def _claimable(now):
+  return Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+
+
+def claim_next():
+  now = timezone.now()
+
+  with transaction.atomic():
+    job = (Job.objects.select_for_update(skip_locked=True)
+                      .filter(_claimable(now)).order_by('run_at','id').first())
+    if job is None:
+      return None
+
+    # conditional on the state read, a worker that got there first on sqlite makes this match nothing
+    claimed = (Job.objects.filter(_claimable(now), id=job.id, status=job.status, locked_at=job.locked_at)
+                          .update(status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1))
+    if not claimed:
+      return None
+
+  job.status, job.locked_at, job.attempts = Job.RUNNING, now, job.attempts + 1
+  return job
+
+
+
+def backoff(attempts):   # seconds before retry number `attempts`
+  return min(settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX)
+
+
+
+def run(job):
+  mine = Job.objects.filter(id=job.id, locked_at=job.locked_at)   # nothing is written back if the job was taken over meanwhile
+
+  try:
+    function = JOBS.get(job.name)
+    if function is None:
+      raise LookupError(f"No job called {job.name!r} is registered")
+    function(**job.payload)
+
+  except Exception:
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+      mine.update(status=Job.FAILED, finished_at=now, last_error=traceback.format_exc())
+      logger.error("job %s (%s) failed for good after %s attempts", job.id, job.name, job.attempts, exc_info=True)
+    else:
+      mine.update(status=Job.QUEUED, locked_at=None, run_at=now + timedelta(seconds=backoff(job.attempts)),
+                  last_error=traceback.format_exc())
+      logger.warning("job %s (%s) failed, attempt %s of %s", job.id, job.name, job.attempts, job.max_attempts, exc_info=True)
+    return False
+
+  mine.update(status=Job.DONE, finished_at=timezone.now(), last_error='')
+  return True
+
+
+
+def ensure_schedules():
+  now = timezone.now()
+  JobSchedule.objects.bulk_create([JobSchedule(name=name, next_run_at=now) for name in settings.JOB_SCHEDULES],
+                                  ignore_conflicts=True)   # other workers may be adding the same rows
+
+
+
+def enqueue_scheduled():
+  now = timezone.now()
+
+  with transaction.atomic():
+    due = list(JobSchedule.objects.select_for_update(skip_locked=True)
+                                  .filter(name__in=list(settings.JOB_SCHEDULES), next_run_at__lte=now))
+    for schedule in due:
+      next_run_at = now + timedelta(seconds=settings.JOB_SCHEDULES[schedule.name])
+      if JobSchedule.objects.filter(id=schedule.id, next_run_at=schedule.next_run_at).update(next_run_at=next_run_at):
+        enqueue(schedule.name)
+
+
+
+def work(should_stop, poll_interval, once=False):
+  # the loop of one worker process. returns when should_stop() is true, with once as soon as nothing is due
+  ensure_schedules()
+
+  while not should_stop():
+    try:
+      enqueue_scheduled()
+      job = claim_next()
+    except DatabaseError:   # database restarting, or a lock another worker holds on sqlite. the worker waits and carries on
+      logger.warning("could not claim a job, retrying in %ss", poll_interval, exc_info=True)
+      close_old_connections()
+    else:
+      if job is not None:
+        run(job)
+        continue
+
+      if once:
+        return
+
+    for _ in range(max(1, int(poll_interval * 10))):   # sleeps in short steps to notice a stop quickly
+      if should_stop():
+        return
+      time.sleep(0.1)
+
+
+
+@job('sweep_overdue_tasks')
+def sweep_overdue_tasks(batch_size=1000):
+  # marks pending tasks whose due date has passed and queues one notification per owner and batch.
+  # tasks are marked with their due date, so moving the due date makes a task due for a notice again
+  today = timezone.localdate()
+  overdue = TaskModel.objects.filter(status=False, due_date__lt=today).exclude(overdue_notified_for=F('due_date'))
+
+  swept = 0
+  while True:
+    with transaction.atomic():   # marking and queueing the notices succeed or fail together
+      rows = list(overdue.select_for_update(skip_locked=True).order_by('owner_id','id').values_list('id','owner_id')[:batch_size])
+      if not rows:
+        return swept
+
+      TaskModel.objects.filter(id__in=[task_id for task_id, owner_id in rows]).update(overdue_notified_for=F('due_date'))
+      for owner_id, tasks in groupby(rows, key=lambda row: row[1]):
+        enqueue('notify_overdue_tasks', {"owner_id":owner_id, "task_ids":[task_id for task_id, _ in tasks]})
+
+    swept += len(rows)
+
+
+
+@job('notify_overdue_tasks')
+def notify_overdue_tasks(owner_id, task_ids):
+  owner = User.objects.filter(id=owner_id, is_active=True).values('username','email').first()
+  tasks = list(TaskModel.objects.filter(id__in=task_ids, owner_id=owner_id, status=False)
+                                .order_by('due_date','id').values_list('title','due_date'))
+  if not owner or not owner['email'] or not tasks:   # gone, deactivated or done since the sweep
+    return
+
+  lines = [f"- {title} (due {due_date:%Y-%m-%d})" for title, due_date in tasks]
+  send_mail(subject=f"You have {len(tasks)} overdue task{'s' if len(tasks) > 1 else ''}",
+            message="\n".join([f"Hi {owner['username']},", "", "these tasks are past their due date:", *lines]),
+            from_email=None,
+            recipient_list=[owner['email']])
+
+
+
+@job('prune_tokens')
+def prune_tokens(batch_size=5000):
+  prune_expired_tokens(batch_size)
+
+
+
+@job('prune_task_changes')
+def prune_task_changes(batch_size=5000):
+  prune_changes(batch_size)
+
+
+
+@job('prune_jobs')
+def prune_jobs():   # finished jobs older than JOB_KEEP_DAYS, failed ones stay for a look
+  Job.objects.filter(status=Job.DONE, finished_at__lt=timezone.now() - timedelta(days=settings.JOB_KEEP_DAYS)).delete()
+
+
+
+@job('rebuild_task_summary')
+def rebuild_task_summary(batch_size=1000):   # scheduled when TASK_STATS_SUMMARY is on, repairs any drift of the summary table
+  rebuild_summary(batch_size)
@@ -0,0 +1,195 @@
+import json
+import time
+from datetime import timedelta
+from itertools import combinations
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from api.management.commands.loadtest import percentile
+from api.models import User, TaskModel
+
+
+# the list filters benchmarked alone and in every pair, {today} and {week} are filled in at run time
+LIST_FILTERS = ["status=false",
+                "due_date={today}",
+                "due_date__gte={today}&due_date__lte={week}",
+                "overdue=true",
+                "q=report",
+                "ordering=due_date",
+                "pagination=cursor",
+                "fields=title,status",
+               ]
+
+BENCH_PASSWORD = "bench-password"
+
+
+class Command(BaseCommand):
+  help = ("Benchmark the task API in process against the configured database, report throughput and "
+          "latency percentiles per scenario and compare them with a JSON baseline")
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=50, help="requests per scenario")
+    parser.add_argument('--tasks', type=int, default=200, help="tasks owned by the benchmark user")
+    parser.add_argument('--cached', action='store_true', help="let list/retrieve requests hit the response cache")
+    parser.add_argument('--output', help="write the results here as JSON")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed regression against the baseline, 0.2 fails on 20%% lower rps or higher p95")
+
+
+  def handle(self, *args, **options):
+    if options['requests'] < 1 or options['tasks'] < 1:
+      raise CommandError("--requests and --tasks must be at least 1")
+
+    if settings.DEBUG:
+      self.stderr.write("DEBUG is on, every query is kept in memory and the numbers will be worse than in production")
+
+    self.requests = options['requests']
+    self.cached   = options['cached']
+    self.sequence = 0
+
+    # every request comes from one address and one user, the throttles would turn most of them away
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], THROTTLING_ENABLED=False):
+      user, staff = self.prepare(options['tasks'])
+      try:
+        results = self.run_scenarios(user, staff)
+      finally:
+        TaskModel.objects.filter(owner_id__in=[user.id, staff.id]).delete()
+
+    report = {"database":connection.vendor,
+              "requests":self.requests,
+              "cached":self.cached,
+              "scenarios":results
+             }
+
+    if options['output']:
+      with open(options['output'], 'w', encoding='utf-8') as output:
+        json.dump(report, output, indent=2)
+
+    if options['baseline']:
+      self.compare(results, options['baseline'], options['threshold'])
+
+
+  def prepare(self, task_count):
+    user, _  = User.objects.get_or_create(username="bench_user", defaults={"email":"bench_user@example.com"})
+    staff, _ = User.objects.get_or_create(username="bench_staff", defaults={"email":"bench_staff@example.com", "is_staff":True})
+    for account in (user, staff):
+      account.set_password(BENCH_PASSWORD)
+      account.save()
+
+    # the same tasks on every run, left overs of an interrupted run go first
+    TaskModel.objects.filter(owner_id__in=[user.id, staff.id]).delete()
+    today = timezone.now().date()
+    for number in range(task_count):
+      TaskModel.objects.create(owner=user, title=f"bench task {number}",
+                               description=f"{'report' if number % 4 == 0 else 'notes'} for benchmark task {number}",
+                               status=number % 3 == 0, due_date=today + timedelta(days=number % 20 - 5))
+    return user, staff
+
+
+  def run_scenarios(self, user, staff):
+    anonymous = Client()
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {self.login(anonymous, user)['access']}")
+    staff_client = Client(HTTP_AUTHORIZATION=f"Bearer {self.login(anonymous, staff)['access']}")
+
+    task_ids = list(TaskModel.objects.filter(owner=user).order_by('id').values_list('id', flat=True))
+    results  = {}
+
+    results['login'] = self.measure('login', lambda i: anonymous.post('/api/auth/login/', {"username":user.username, "password":BENCH_PASSWORD},
+                                                                      content_type='application/json'))
+
+    refresh = [self.login(anonymous, user)['refresh']]
+    def refresh_token(i):   # refresh tokens rotate, every request uses the one the previous request got back
+      response = anonymous.post('/api/auth/refresh/', {"refresh":refresh[0]}, content_type='application/json')
+      refresh[0] = response.json().get('refresh', refresh[0])
+      return response
+    results['refresh'] = self.measure('refresh', refresh_token)
+
+    results['create'] = self.measure('create', lambda i: client.post('/api/tasks/create/', {"title":f"bench created {i}"},
+                                                                     content_type='application/json'))
+
+    today = timezone.now().date()
+    week  = today + timedelta(days=7)
+    for size in (0, 1, 2):
+      for combination in combinations(LIST_FILTERS, size):
+        if "pagination=cursor" in combination and "ordering=due_date" in combination:
+          continue   # rejected by design, cursor pages are always newest first
+        query = "&".join(combination).format(today=today, week=week)
+        results[f"list?{query}"] = self.measure(f"list?{query}", lambda i, query=query: client.get(self.url('/api/tasks/list/', query)))
+
+    results['list?owner= (staff)'] = self.measure('list?owner= (staff)', lambda i: staff_client.get(self.url('/api/tasks/list/', f"owner={user.id}")))
+
+    results['retrieve'] = self.measure('retrieve', lambda i: client.get(self.url(f'/api/tasks/retrieve/{task_ids[i % len(task_ids)]}/', "")))
+    results['update']   = self.measure('update', lambda i: client.put(f'/api/tasks/update/{task_ids[i % len(task_ids)]}/', {"status":i % 2 == 0},
+                                                                      content_type='application/json'))
+
+    created_ids = list(TaskModel.objects.filter(owner=user, title__startswith="bench created").order_by('id').values_list('id', flat=True))
+    results['delete'] = self.measure('delete', lambda i: client.delete(f'/api/tasks/delete/{created_ids[i]}/'), len(created_ids))
+
+    return results
+
+
+  def login(self, client, user):
+    response = client.post('/api/auth/login/', {"username":user.username, "password":BENCH_PASSWORD}, content_type='application/json')
+    if response.status_code != 200:
+      raise CommandError(f"benchmark login failed with {response.status_code}: {response.content[:200]!r}")
+    return response.json()
+
+
+  def url(self, path, query):
+    # a throwaway parameter gives every request its own response cache key, unless --cached
+    if not self.cached:
+      self.sequence += 1
+      query = f"{query}&_={self.sequence}" if query else f"_={self.sequence}"
+    return f"{path}?{query}" if query else path
+
+
+  def measure(self, name, send, count=None):
+    count = self.requests if count is None else count
+    latencies, errors = [], 0
+
+    started = time.perf_counter()
+    for i in range(count):
+      start = time.perf_counter()
+      response = send(i)
+      latencies.append((time.perf_counter() - start) * 1000)
+      if response.status_code >= 400:
+        errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {"requests":count,
+              "errors":errors,
+              "rps":round(count / elapsed, 1) if elapsed else 0,
+              "p50":round(percentile(latencies, 50), 2),
+              "p95":round(percentile(latencies, 95), 2),
+              "p99":round(percentile(latencies, 99), 2)
+             }
+
+    self.stdout.write(f"{name:<70} {result['rps']:>8} rps  p50 {result['p50']:>7} ms  p95 {result['p95']:>7} ms  "
+                      f"p99 {result['p99']:>7} ms  errors {errors}")
+    return result
+
+
+  def compare(self, results, baseline_path, threshold):
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+      baseline = json.load(baseline_file)['scenarios']
+
+    regressions = []
+    for name, result in results.items():
+      before = baseline.get(name)
+      if not before:
+        continue
+      if result['rps'] < before['rps'] * (1 - threshold):
+        regressions.append(f"{name}: {before['rps']} -> {result['rps']} rps")
+      if result['p95'] > before['p95'] * (1 + threshold):
+        regressions.append(f"{name}: p95 {before['p95']} -> {result['p95']} ms")
+
+    if regressions:
+      raise CommandError("regressions against the baseline:\n  " + "\n  ".join(regressions))
+
+    self.stdout.write(self.style.SUCCESS(f"no regressions past {threshold:.0%} against {baseline_path}"))
@@ -0,0 +1,65 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from api.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+
+
+PASSWORD = "benchmark-password-123"
+
+
+class Command(BaseCommand):
+  help = ("Time password verification, the cost of a login, for django's default hashers and the configured ones. "
+          "One thread measures logins per second per core")
+
+  def add_arguments(self, parser):
+    parser.add_argument('--seconds', type=float, default=3, help="time spent per configuration")
+    parser.add_argument('--threads', type=int, default=1, help="verify on this many threads at once")
+
+
+  def handle(self, *args, **options):
+    if options['seconds'] <= 0 or options['threads'] < 1:
+      raise CommandError("--seconds must be positive and --threads at least 1")
+
+    preferred = import_string(settings.PASSWORD_HASHERS[0])
+    cases = [("pbkdf2_sha256 (django default)", hashers.PBKDF2PasswordHasher()),
+             ("scrypt (django default)",        hashers.ScryptPasswordHasher()),
+             ("scrypt (configured)",            ScryptPasswordHasher()),
+             ("argon2 (django default)",        hashers.Argon2PasswordHasher()),
+             ("argon2 (configured)",            Argon2PasswordHasher()),
+            ]
+
+    cores = min(options['threads'], os.cpu_count() or 1)
+    self.stdout.write(f"{options['threads']} thread(s) on {os.cpu_count()} core(s), new hashes use {settings.PASSWORD_HASHER}")
+
+    for name, hasher in cases:
+      try:
+        encoded = hasher.encode(PASSWORD, hasher.salt())
+      except ValueError as exc:   # argon2-cffi missing, or scrypt past openssl's memory limit
+        self.stdout.write(f"{name:<32} skipped: {exc}")
+        continue
+
+      logins, elapsed = self.run(hasher, encoded, options['seconds'], options['threads'])
+      marker = "  <- PASSWORD_HASHER" if type(hasher) is preferred else ""
+      self.stdout.write(f"{name:<32} {elapsed / logins * options['threads'] * 1000:8.1f} ms / login  "
+                        f"{logins / elapsed:8.1f} logins/s  {logins / elapsed / cores:8.1f} logins/s/core{marker}")
+
+
+  def run(self, hasher, encoded, seconds, threads):
+    def verify_until(deadline):
+      count = 0
+      while time.perf_counter() < deadline:
+        if not hasher.verify(PASSWORD, encoded):
+          raise CommandError(f"{hasher.algorithm} failed to verify its own hash")
+        count += 1
+      return count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+      counts = list(pool.map(verify_until, [started + seconds] * threads))
+    return max(sum(counts), 1), time.perf_counter() - started
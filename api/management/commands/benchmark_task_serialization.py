@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.models import User, TaskModel
+from api.serializers import LeanTaskSerializer, TaskSerializer
+
+
+class Command(BaseCommand):
+  help = "Time the task list serializers on in-memory tasks, reported per 1,000 tasks"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20, help="runs per case, the best one is reported")
+
+
+  def handle(self, *args, **options):
+    if options['tasks'] < 1 or options['repeat'] < 1:
+      raise CommandError("--tasks and --repeat must be at least 1")
+
+    tasks = self.make_tasks(options['tasks'])
+
+    full     = LeanTaskSerializer()
+    sparse   = LeanTaskSerializer(['title','status','due_date'])
+    expanded = LeanTaskSerializer(expand_owner=True)
+
+    cases = [("TaskSerializer",                  lambda: TaskSerializer(tasks, many=True).data),
+             ("LeanTaskSerializer",              self.lean_case(full, tasks)),
+             ("LeanTaskSerializer fields=title,status,due_date", self.lean_case(sparse, tasks)),
+             ("LeanTaskSerializer expand=owner", self.lean_case(expanded, tasks)),
+            ]
+
+    per_thousand = 1000 / len(tasks)
+    for name, case in cases:
+      best = min(self.timed(case) for _ in range(options['repeat']))
+      self.stdout.write(f"{name:<50} {best * per_thousand * 1000:8.2f} ms / 1000 tasks")
+
+
+  def make_tasks(self, count):
+    # never saved, so the benchmark measures serialization alone and needs no data
+    now   = timezone.now()
+    owner = User(id=1, username="benchmark", email="benchmark@example.com")
+
+    return [TaskModel(id=number, owner=owner, title=f"task {number}", description="lorem ipsum dolor sit amet " * 20,
+                      status=number % 2 == 0, due_date=now.date() + timedelta(days=number % 30),
+                      created_at=now - timedelta(minutes=number), updated_at=now)
+            for number in range(1, count + 1)
+           ]
+
+
+  def lean_case(self, serializer, tasks):
+    # the values() rows the list view would fetch for this serializer
+    rows = [{column:self.column_value(task, column) for column in serializer.columns()} for task in tasks]
+    return lambda: serializer.to_representation(rows)
+
+
+  def column_value(self, task, column):
+    if column.startswith('owner__'):
+      return getattr(task.owner, column[len('owner__'):])
+    return getattr(task, column)
+
+
+  def timed(self, case):
+    start = time.perf_counter()
+    case()
+    return time.perf_counter() - start
@@ -0,0 +1,167 @@
+import csv
+import json
+import sys
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from api import bulk
+from api.models import TaskModel, default_due_date
+from api.signals import tasks_changed, CREATED
+from api.serializers import TaskBulkSerializer
+
+
+DUPLICATE_TITLE = {"title":"A task with the same title already exists"}
+
+# columns an imported task is inserted with, search_vector is filled in by its trigger
+INSERTED_FIELDS = ('owner','title','description','status','due_date','created_at','updated_at')
+
+
+class Command(BaseCommand):
+  help = "Stream tasks from an NDJSON or CSV file into the database in batches"
+
+  def add_arguments(self, parser):
+    parser.add_argument('path', help="file to import, '-' reads from stdin")
+    parser.add_argument('--format', choices=['ndjson','csv'], help="defaults to the file extension")
+    parser.add_argument('--owner', type=int, help="owner id for rows without an owner column")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--rejects', help="write rejected rows here as ndjson instead of stderr")
+
+
+  def handle(self, *args, **options):
+    file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+    batch_size  = options['batch_size']
+
+    if batch_size < 1:
+      raise CommandError("--batch-size must be at least 1")
+
+    source  = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+    rejects = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else self.stderr
+
+    self.known_owners = set()
+    self.read = self.inserted = self.rejected = 0
+
+    try:
+      rows = self.csv_rows(source) if file_format == 'csv' else self.ndjson_rows(source)
+
+      while True:
+        batch = list(islice(rows, batch_size))   # only one batch of the file is held in memory at a time
+        if not batch:
+          break
+
+        self.import_batch(batch, options['owner'], rejects)
+        self.stdout.write(self.progress())
+    finally:
+      if source is not sys.stdin:
+        source.close()
+      if options['rejects']:
+        rejects.close()
+
+    self.stdout.write(self.style.SUCCESS(f"done: {self.progress()}"))
+
+
+  def progress(self):
+    return f"read {self.read}, inserted {self.inserted}, rejected {self.rejected}"
+
+
+  def ndjson_rows(self, source):
+    for line_number, line in enumerate(source, start=1):
+      if not line.strip():
+        continue
+      try:
+        yield line_number, json.loads(line)
+      except ValueError:
+        yield line_number, None
+
+
+  def csv_rows(self, source):
+    reader = csv.DictReader(source)
+    for row in reader:
+      # empty cells mean "not given", the same as a missing key in ndjson
+      yield reader.line_num, {key: value for key, value in row.items() if value != ''}
+
+
+  def import_batch(self, batch, default_owner, rejects):
+    valid = []
+    for line_number, row in batch:
+      self.read += 1
+
+      if not isinstance(row, dict):
+        self.reject(rejects, line_number, {"detail":"Invalid JSON object"})
+        continue
+
+      serializer = TaskBulkSerializer(data=row)
+      if not serializer.is_valid():
+        self.reject(rejects, line_number, serializer.errors)
+        continue
+
+      owner_id = bulk.parse_id(row.get('owner', default_owner))
+      valid.append((line_number, serializer.validated_data, owner_id))
+
+
+    unknown = {owner_id for line_number, data, owner_id in valid if owner_id not in self.known_owners}
+    self.known_owners |= bulk.existing_owner_ids(unknown)
+
+    tasks, lines = [], {}   # lines maps (owner_id, title) to the line the task came from
+    for line_number, data, owner_id in valid:
+      if owner_id not in self.known_owners:
+        self.reject(rejects, line_number, {"owner":"User with this ID does not exist"})
+        continue
+
+      if (owner_id, data['title']) in lines:   # the same title twice in one batch, the first one goes in
+        self.reject(rejects, line_number, DUPLICATE_TITLE)
+        continue
+      lines[owner_id, data['title']] = line_number
+
+      task = TaskModel(owner_id=owner_id, **data)
+      if not task.due_date:   # the insert skips TaskModel.save
+        task.due_date = default_due_date()
+      tasks.append(task)
+
+    if not tasks:
+      return
+
+    alias = router.db_for_write(TaskModel)
+    with transaction.atomic(using=alias):
+      inserted = self.insert_tasks(alias, tasks)
+      tasks_changed.send(sender=TaskModel, changes=[(CREATED, task.id, task.owner_id) for task in inserted],
+                         buckets=[(*task.counted_bucket(), 1) for task in inserted])
+
+    self.inserted += len(inserted)
+
+    # whatever didn't come back clashed with a title its owner already has (unique_task_per_user)
+    for task in inserted:
+      del lines[task.owner_id, task.title]
+    for line_number in lines.values():
+      self.reject(rejects, line_number, DUPLICATE_TITLE)
+
+
+  def insert_tasks(self, alias, tasks):
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING the rows that went in, so a taken title neither fails the batch
+    # nor needs a query to find out which rows were new. chunked like bulk_create, to stay under the parameter limit
+    connection = connections[alias]
+    quote_name = connection.ops.quote_name
+    meta       = TaskModel._meta
+    fields     = [meta.get_field(name) for name in INSERTED_FIELDS]
+
+    columns   = ", ".join(quote_name(field.column) for field in fields)
+    returning = ", ".join(quote_name(column) for column in ('id','owner_id','title','status','due_date'))
+    row       = f"({', '.join(['%s'] * len(fields))})"
+    conflict  = f"ON CONFLICT ({quote_name('owner_id')}, {quote_name('title')}) DO NOTHING"
+
+    inserted   = []
+    chunk_size = connection.ops.bulk_batch_size(fields, tasks)
+    for start in range(0, len(tasks), chunk_size):
+      chunk  = tasks[start:start + chunk_size]
+      params = [field.get_db_prep_save(field.pre_save(task, True), connection) for task in chunk for field in fields]
+      sql    = (f"INSERT INTO {quote_name(meta.db_table)} ({columns}) VALUES {', '.join([row] * len(chunk))} "
+                f"{conflict} RETURNING {returning}")
+      inserted += TaskModel.objects.db_manager(alias).raw(sql, params)   # raw() converts the returned columns
+
+    return inserted
+
+
+  def reject(self, rejects, line_number, errors):
+    self.rejected += 1
+    rejects.write(json.dumps({"line":line_number, "errors":errors}) + "\n")
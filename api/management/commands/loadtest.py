@@ -0,0 +1,89 @@
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+  help = "Hammer running API endpoints and report requests per second and latency percentiles per URL"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--url', action='append', required=True, help="full URL, repeat to compare endpoints")
+    parser.add_argument('--token', help="access token sent as the Bearer authorization header")
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10, help="seconds per URL")
+
+
+  def handle(self, *args, **options):
+    if options['concurrency'] < 1:
+      raise CommandError("--concurrency must be at least 1")
+
+    headers = {"Authorization":f"Bearer {options['token']}"} if options['token'] else {}
+
+    for url in options['url']:
+      result = run_load(url, headers, options['concurrency'], options['duration'])
+      self.stdout.write(f"{url}\n"
+                        f"  requests {result['requests']}  errors {result['errors']}  rps {result['rps']:.1f}\n"
+                        f"  p50 {result['p50']:.1f}ms  p95 {result['p95']:.1f}ms  p99 {result['p99']:.1f}ms")
+
+
+
+def run_load(url, headers, concurrency, duration):
+  # one keep-alive connection per worker thread, like a pool of clients each waiting on its own answer
+  parts = urlsplit(url)
+  path  = parts.path + (f"?{parts.query}" if parts.query else "")
+  connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+
+  latencies, errors = [], []
+  lock = threading.Lock()
+  deadline = time.monotonic() + duration
+
+  def worker():
+    connection = connection_class(parts.netloc, timeout=30)
+    timings, failed = [], 0
+
+    while time.monotonic() < deadline:
+      start = time.perf_counter()
+      try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status >= 400:
+          failed += 1
+      except (OSError, http.client.HTTPException):
+        failed += 1
+        connection.close()
+        connection = connection_class(parts.netloc, timeout=30)
+        continue
+      timings.append((time.perf_counter() - start) * 1000)
+
+    connection.close()
+    with lock:
+      latencies.extend(timings)
+      errors.append(failed)
+
+  started = time.monotonic()
+  threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  elapsed = time.monotonic() - started
+
+  latencies.sort()
+  return {"requests":len(latencies),
+          "errors":sum(errors),
+          "rps":len(latencies) / elapsed if elapsed else 0,
+          "p50":percentile(latencies, 50),
+          "p95":percentile(latencies, 95),
+          "p99":percentile(latencies, 99)
+         }
+
+
+
+def percentile(values, pct):   # values are sorted
+  if not values:
+    return 0
+  return values[min(len(values) - 1, int(len(values) * pct / 100))]
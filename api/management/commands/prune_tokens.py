@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+  help = "Delete expired outstanding and blacklisted refresh tokens in batches"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--sleep', type=float, default=0, help="seconds to pause between batches")
+
+
+  def handle(self, *args, **options):
+    if options['batch_size'] < 1:
+      raise CommandError("--batch-size must be at least 1")
+
+    self.stdout.write(self.style.SUCCESS(f"pruned {prune_expired_tokens(options['batch_size'], options['sleep'])} expired tokens"))
+
+
+
+def prune_expired_tokens(batch_size, sleep=0):
+  # short transactions on a bounded set of rows, so the token tables stay writable while this runs
+  now = timezone.now()
+  pruned = 0
+
+  while True:
+    ids = list(OutstandingToken.objects.filter(expires_at__lt=now).order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+      return pruned
+
+    with transaction.atomic():
+      BlacklistedToken.objects.filter(token_id__in=ids).delete()
+      OutstandingToken.objects.filter(id__in=ids).delete()
+
+    pruned += len(ids)
+    if sleep:
+      time.sleep(sleep)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.stats import rebuild_summary
+
+
+class Command(BaseCommand):
+  help = "Recount the TaskSummary rows of every user from their tasks"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help="users recounted per transaction")
+
+
+  def handle(self, *args, **options):
+    if options['batch_size'] < 1:
+      raise CommandError("--batch-size must be at least 1")
+
+    self.stdout.write(self.style.SUCCESS(f"rebuilt the task summary of {rebuild_summary(options['batch_size'])} users"))
@@ -0,0 +1,64 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def worker_process(stop, poll_interval, once):
+  # entry point of a child process. started with spawn (windows, macos) it comes up without django
+  # set up, so nothing touching the models is imported before this runs
+  import django
+  django.setup()
+  from api.jobs import work
+
+  signal.signal(signal.SIGINT, signal.SIG_IGN)   # ctrl-c reaches the whole group, the parent stops the children through `stop`
+  work(stop.is_set, poll_interval, once)
+
+
+
+class Command(BaseCommand):
+  help = ("Run background jobs (overdue task notices, token and job pruning, ...) and their schedules. "
+          "Any number of these can run against the same database")
+
+  def add_arguments(self, parser):
+    parser.add_argument('--processes', type=int, default=1, help="worker processes, each runs one job at a time")
+    parser.add_argument('--poll-interval', type=float, default=2, help="seconds to wait when no job is due")
+    parser.add_argument('--once', action='store_true', help="exit once no job is due, e.g. from cron")
+    parser.add_argument('--enqueue', metavar='JOB', help="queue one run of this job and exit")
+
+
+  def handle(self, *args, **options):
+    from api.jobs import JOBS, enqueue, work
+
+    if options['enqueue']:
+      if options['enqueue'] not in JOBS:
+        raise CommandError(f"Unknown job {options['enqueue']!r}, choose from {', '.join(sorted(JOBS))}")
+      self.stdout.write(self.style.SUCCESS(f"queued {enqueue(options['enqueue'])}"))
+      return
+
+    if options['processes'] < 1 or options['poll_interval'] <= 0:
+      raise CommandError("--processes must be at least 1 and --poll-interval positive")
+
+    stop = multiprocessing.Event() if options['processes'] > 1 else threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+      signal.signal(signum, lambda *args: stop.set())   # the job at hand is finished first
+
+    if options['processes'] == 1:
+      work(stop.is_set, options['poll_interval'], options['once'])
+      return
+
+    connections.close_all()   # forked children must not share the parent's connections
+    workers = [multiprocessing.Process(target=worker_process, args=(stop, options['poll_interval'], options['once']), daemon=False)
+               for _ in range(options['processes'])]
+    for worker in workers:
+      worker.start()
+    self.stdout.write(f"{len(workers)} workers running, ctrl-c stops them after their current job")
+
+    for worker in workers:
+      worker.join()
+
+    failed = [worker.exitcode for worker in workers if worker.exitcode]
+    if failed:
+      raise CommandError(f"{len(failed)} worker(s) exited with an error")
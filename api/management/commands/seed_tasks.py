@@ -0,0 +1,96 @@
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.caching import STAFF_SCOPE, bump_versions
+from api.models import User, TaskModel
+from api.stats import rebuild_summary
+
+
+WORDS = ("report review meeting invoice deploy release design draft client budget email call "
+         "schedule update fix test plan write read prepare send check order book pay renew").split()
+
+
+class Command(BaseCommand):
+  help = "Create seed_user_<n> users with tasks for benchmarks, e.g. --users 10000 --tasks-per-user 1000"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--tasks-per-user', type=int, default=100)
+    parser.add_argument('--password', default="seed-password", help="password of every seeded user")
+    parser.add_argument('--batch-users', type=int, default=100, help="users whose tasks are inserted per transaction")
+    parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed gives the same data")
+
+
+  def handle(self, *args, **options):
+    if min(options['users'], options['tasks_per_user'], options['batch_users']) < 1:
+      raise CommandError("--users, --tasks-per-user and --batch-users must be at least 1")
+
+    random.seed(options['seed'])
+    started = time.monotonic()
+
+    # hashing is deliberately slow, every seeded user shares one hash
+    password = make_password(options['password'])
+    User.objects.bulk_create([User(username=f"seed_user_{number}", email=f"seed_user_{number}@example.com", password=password)
+                              for number in range(1, options['users'] + 1)
+                             ], batch_size=1000, ignore_conflicts=True)
+
+    owner_ids = list(User.objects.filter(username__startswith="seed_user_").order_by('id').values_list('id', flat=True)[:options['users']])
+
+    for start in range(0, len(owner_ids), options['batch_users']):
+      batch = owner_ids[start:start + options['batch_users']]
+      with transaction.atomic():
+        if connection.vendor == 'postgresql':
+          self.insert_tasks_sql(batch, options['tasks_per_user'])
+        else:
+          self.insert_tasks_orm(batch, options['tasks_per_user'])
+
+      self.stdout.write(f"{start + len(batch)}/{len(owner_ids)} users seeded")
+
+    # seeded rows skip TaskModel.save, so the caches and the summary table are brought up to date here.
+    # the sync feed only lists changes made after seeding
+    bump_versions([*owner_ids, STAFF_SCOPE])
+    if settings.TASK_STATS_SUMMARY:
+      rebuild_summary()
+
+    self.stdout.write(self.style.SUCCESS(f"seeded {len(owner_ids)} users with {options['tasks_per_user']} tasks each "
+                                         f"in {time.monotonic() - started:.1f}s"))
+
+
+  def insert_tasks_sql(self, owner_ids, tasks_per_user):
+    # generated inside postgres, nothing crosses the wire per row
+    with connection.cursor() as cursor:
+      cursor.execute("""
+        INSERT INTO api_taskmodel (owner_id, title, description, status, due_date, created_at, updated_at)
+        SELECT owner_id,
+               'Task ' || number,
+               (%s::text[])[1 + floor(random() * %s)::int] || ' ' || (%s::text[])[1 + floor(random() * %s)::int] || ' task number ' || number,
+               random() < 0.3,
+               current_date + (floor(random() * 90)::int - 30),
+               now() - random() * interval '365 days',
+               now()
+        FROM unnest(%s::bigint[]) AS owner_id
+        CROSS JOIN generate_series(1, %s) AS number
+        ON CONFLICT DO NOTHING
+      """, [WORDS, len(WORDS), WORDS, len(WORDS), owner_ids, tasks_per_user])
+
+
+  def insert_tasks_orm(self, owner_ids, tasks_per_user):
+    today = timezone.now().date()
+
+    tasks = (TaskModel(owner_id=owner_id,
+                       title=f"Task {number}",
+                       description=f"{random.choice(WORDS)} {random.choice(WORDS)} task number {number}",
+                       status=random.random() < 0.3,
+                       due_date=today + timedelta(days=random.randint(-30, 59)))
+             for owner_id in owner_ids
+             for number in range(1, tasks_per_user + 1)
+            )
+
+    TaskModel.objects.bulk_create(tasks, batch_size=5000, ignore_conflicts=True)
@@ -0,0 +1,110 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Lower
+from django.test import Client, override_settings
+
+from api.management.commands.loadtest import percentile
+from api.models import User
+
+
+PREFIX = "stress_"
+
+
+class Command(BaseCommand):
+  help = ("Register users from many threads at once against the configured database, with groups of requests "
+          "fighting over the same username or email in different case, and check every response and the rows left")
+
+  def add_arguments(self, parser):
+    parser.add_argument('--users', type=int, default=200, help="registrations with unique names")
+    parser.add_argument('--contested', type=int, default=20, help="names registered by every thread at once")
+    parser.add_argument('--threads', type=int, default=8)
+
+
+  def handle(self, *args, **options):
+    if options['users'] < 0 or options['contested'] < 0 or options['threads'] < 2:
+      raise CommandError("--users and --contested can't be negative, --threads must be at least 2")
+
+    User.objects.filter(username__startswith=PREFIX).delete()   # left overs of an interrupted run
+    attempts = self.attempts(options['users'], options['contested'], options['threads'])
+
+    started = time.perf_counter()
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], THROTTLING_ENABLED=False):
+      with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+        results = list(pool.map(self.register, attempts))
+    elapsed = time.perf_counter() - started
+
+    try:
+      problems = self.verify(attempts, results)
+    finally:
+      User.objects.filter(username__startswith=PREFIX).delete()
+
+    latencies = sorted(latency for _, _, latency in results)
+    statuses  = Counter(code for code, _, _ in results)
+    self.stdout.write(f"{len(results)} registrations on {options['threads']} threads in {elapsed:.2f}s, "
+                      f"{len(results) / elapsed:.1f}/s, p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms, "
+                      f"responses {dict(sorted(statuses.items()))}")
+
+    if problems:
+      raise CommandError("\n  ".join(["wrong results:", *problems[:20]]))
+    self.stdout.write(self.style.SUCCESS("every registration got the expected answer"))
+
+
+  def attempts(self, users, contested, threads):
+    # (group, field the group fights over, username, email). unique registrations are groups of one
+    attempts = [(f"unique {number}", None, f"{PREFIX}{number}", f"{PREFIX}{number}@example.com") for number in range(users)]
+
+    for number in range(contested):
+      name = f"{PREFIX}contested_{number}"
+      for thread in range(threads):
+        if number % 2:   # same username in another case, emails all different
+          attempts.append((name, 'username', name.upper() if thread % 2 else name, f"{name}_{thread}@example.com"))
+        else:            # same email in another case, usernames all different
+          attempts.append((name, 'email', f"{name}_{thread}", f"{name.upper() if thread % 2 else name}@example.com"))
+
+    # contested attempts next to each other, so they run at the same time
+    return sorted(attempts, key=lambda attempt: attempt[0])
+
+
+  def register(self, attempt):
+    _, _, username, email = attempt
+    client = Client()
+    try:
+      start = time.perf_counter()
+      response = client.post('/api/auth/register/', {"username":username, "email":email, "password":"stress-password-123"},
+                             content_type='application/json')
+      latency = (time.perf_counter() - start) * 1000
+      body = response.json() if response.get('Content-Type') == 'application/json' else {}
+      return response.status_code, body, latency
+    finally:
+      connection.close()   # every worker thread has its own connection
+
+
+  def verify(self, attempts, results):
+    problems = []
+    groups = {}
+    for (group, field, username, _), (code, body, _) in zip(attempts, results):
+      groups.setdefault(group, []).append((field, username, code, body))
+
+    for group, answers in groups.items():
+      created = [answer for answer in answers if answer[2] == 201]
+      if len(created) != 1:
+        problems.append(f"{group}: {len(created)} registrations succeeded instead of 1")
+
+      for field, username, code, body in answers:
+        if code not in (201, 400):
+          problems.append(f"{group}: {username} got {code} {body}")
+        elif code == 400 and (field is None or field not in body):
+          problems.append(f"{group}: {username} was turned away with {body}, expected a {field} error")
+
+    for column in ('username', 'email'):
+      duplicates = (User.objects.filter(username__startswith=PREFIX).values(lowered=Lower(column))
+                                .annotate(count=Count('id')).filter(count__gt=1))
+      problems += [f"{row['count']} users share the {column} {row['lowered']}" for row in duplicates]
+
+    return problems
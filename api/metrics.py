@@ -0,0 +1,193 @@
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+from api.caching import get_counters
+
+
+# per view request metrics: wall time, database queries and time, serializer time and
+# response size. the numbers of the current request live in a context var, which the
+# database wrapper and the serializers add to, and end up in a Server-Timing header and
+# in per process histograms served as Prometheus text by metrics_view. the wrapper is only
+# on the connections while a request runs, management commands and jobs run unwrapped.
+# every request costs a few clock reads and one locked update of the histograms, nothing
+# is formatted unless a query is slow or the metrics are scraped
+
+logger = logging.getLogger('api.performance')
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+class Histogram:
+
+  def __init__(self, name, description, buckets):
+    self.name        = name
+    self.description = description
+    self.buckets     = buckets
+    self.series      = {}   # view -> per bucket counts (the last one is +Inf), sum
+
+
+  def observe(self, view, value):
+    series = self.series.get(view)
+    if series is None:
+      series = self.series[view] = [[0] * (len(self.buckets) + 1), 0]
+
+    series[0][bisect_left(self.buckets, value)] += 1
+    series[1] += value
+
+
+  def exposition(self):
+    lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+
+    for view, (counts, total) in sorted(self.series.items()):
+      cumulative = 0
+      for bound, count in zip([*self.buckets, '+Inf'], counts):
+        cumulative += count
+        lines.append(f'{self.name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+      lines.append(f'{self.name}_sum{{view="{view}"}} {total}')
+      lines.append(f'{self.name}_count{{view="{view}"}} {cumulative}')
+
+    return lines
+
+
+
+SECONDS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+HISTOGRAMS = {"duration":Histogram('api_request_duration_seconds', "Wall time of the request", SECONDS),
+              "db_time":Histogram('api_request_db_duration_seconds', "Time spent in database queries", SECONDS),
+              "db_queries":Histogram('api_request_db_queries', "Database queries per request", [0, 1, 2, 3, 5, 10, 20, 50, 100]),
+              "serializer_time":Histogram('api_request_serializer_duration_seconds', "Time spent serializing", SECONDS),
+              "response_size":Histogram('api_response_size_bytes', "Size of the response body", [256, 1024, 4096, 16384, 65536, 262144, 1048576]),
+             }
+
+_histograms_lock = threading.Lock()
+
+
+def record(view, stats):
+  with _histograms_lock:
+    for key, histogram in HISTOGRAMS.items():
+      histogram.observe(view, stats[key])
+
+
+
+@contextmanager
+def timed_serialization():   # adds the time of the block to the serializer time of the current request
+  stats = _request_stats.get()
+  if stats is None:
+    yield
+    return
+
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    stats['serializer_time'] += time.perf_counter() - start
+
+
+
+def measure_query(execute, sql, params, many, context):
+  stats = _request_stats.get()
+  start = time.perf_counter()
+  try:
+    return execute(sql, params, many, context)
+  finally:
+    elapsed = time.perf_counter() - start
+    if stats is not None:
+      stats['db_queries'] += 1
+      stats['db_time'] += elapsed
+    if settings.SLOW_QUERY_MS and elapsed * 1000 >= settings.SLOW_QUERY_MS:
+      logger.warning("slow query (%.1f ms) on %s: %s", elapsed * 1000, context['connection'].alias, sql)
+
+
+
+def _wrap_queries():
+  # on the connections of the calling thread, closing the stack takes it off again
+  stack = ExitStack()
+  for alias in connections:
+    stack.enter_context(connections[alias].execute_wrapper(measure_query))
+  return stack
+
+
+
+def _new_stats():
+  return {"db_queries":0, "db_time":0.0, "serializer_time":0.0}
+
+
+def _finish(request, response, stats, start):
+  stats['duration'] = time.perf_counter() - start
+  stats['response_size'] = 0 if response.streaming else len(response.content)   # streamed bodies aren't known yet
+
+  view = request.resolver_match.view_name if request.resolver_match else "unresolved"
+  record(view, stats)
+
+  response['Server-Timing'] = (f"app;dur={stats['duration'] * 1000:.1f}, "
+                               f"db;dur={stats['db_time'] * 1000:.1f};desc=\"{stats['db_queries']} queries\", "
+                               f"serializer;dur={stats['serializer_time'] * 1000:.1f}")
+  return response
+
+
+
+@sync_and_async_middleware
+def performance_middleware(get_response):
+  if not settings.PERFORMANCE_METRICS:
+    raise MiddlewareNotUsed
+
+  if iscoroutinefunction(get_response):
+    async def middleware(request):
+      stats, start = _new_stats(), time.perf_counter()
+      token = _request_stats.set(stats)
+      # the async ORM queries on the request's sync thread, which has connections of its own
+      queries = await sync_to_async(_wrap_queries)()
+      try:
+        response = await get_response(request)
+      finally:
+        await sync_to_async(queries.close)()
+        _request_stats.reset(token)
+      return _finish(request, response, stats, start)
+
+  else:
+    def middleware(request):
+      stats, start = _new_stats(), time.perf_counter()
+      token = _request_stats.set(stats)
+      try:
+        with _wrap_queries():
+          response = get_response(request)
+      finally:
+        _request_stats.reset(token)
+      return _finish(request, response, stats, start)
+
+  return middleware
+
+
+
+def metrics_view(request):
+  # Prometheus text format. the numbers are per process, scrape every worker. without
+  # METRICS_TOKEN only staff signed in to the admin get them
+  if settings.METRICS_TOKEN:
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {settings.METRICS_TOKEN}"):
+      return HttpResponse(status=401)
+  elif not request.user.is_staff:
+    return HttpResponse(status=403)
+
+  with _histograms_lock:
+    lines = [line for histogram in HISTOGRAMS.values() for line in histogram.exposition()]
+
+  counters = get_counters()
+  lines += ["# HELP api_task_cache_requests_total Task response cache lookups",
+            "# TYPE api_task_cache_requests_total counter",
+            f'api_task_cache_requests_total{{result="hit"}} {counters["hit"]}',
+            f'api_task_cache_requests_total{{result="miss"}} {counters["miss"]}',
+           ]
+
+  return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4")
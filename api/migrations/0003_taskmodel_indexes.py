@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_taskmodel_due_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taskmodel',
+            index=models.Index(fields=['owner', 'status', 'due_date'], name='task_owner_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskmodel',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='task_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskmodel',
+            index=models.Index(fields=['status', 'due_date'], name='task_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskmodel',
+            index=models.Index(fields=['due_date'], name='task_due_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskmodel',
+            index=models.Index(fields=['created_at', 'id'], name='task_created_idx'),
+        ),
+    ]
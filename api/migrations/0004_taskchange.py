@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_taskmodel_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.BigIntegerField()),
+                ('owner_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner_id', 'id'], name='task_change_owner_seq_idx')],
+            },
+        ),
+        # existing tasks enter the feed as created, so a first sync from 0 sees all of them
+        migrations.RunSQL(
+            sql="INSERT INTO api_taskchange (task_id, owner_id, action, changed_at) "
+                "SELECT id, owner_id, 'created', updated_at FROM api_taskmodel ORDER BY id",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
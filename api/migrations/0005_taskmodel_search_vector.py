@@ -0,0 +1,54 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# the trigger only exists on postgres, other databases (sqlite test runs) keep search_vector
+# empty and search with a substring match instead. this migration only adds the column and
+# the trigger, which take a short lock each. existing rows are filled in batches by 0012
+# and the GIN index is built concurrently by 0013, both outside a transaction
+
+SEARCH_TRIGGER_SQL = """
+CREATE FUNCTION api_taskmodel_search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector :=
+    setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_taskmodel_search_vector_trigger
+BEFORE INSERT OR UPDATE OF title, description ON api_taskmodel
+FOR EACH ROW EXECUTE FUNCTION api_taskmodel_search_vector_update();
+"""
+
+DROP_SEARCH_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS api_taskmodel_search_vector_trigger ON api_taskmodel;
+DROP FUNCTION IF EXISTS api_taskmodel_search_vector_update();
+"""
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SEARCH_TRIGGER_SQL)
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_TRIGGER_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_taskchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskmodel',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
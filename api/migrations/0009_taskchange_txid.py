@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='taskchange',
+            name='task_change_owner_seq_idx',
+        ),
+        # rows already logged are all committed, with txid 0 they come before anything written from now on
+        migrations.AddField(
+            model_name='taskchange',
+            name='txid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='taskchange',
+            index=models.Index(fields=['owner_id', 'txid', 'id'], name='task_change_owner_txid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskchange',
+            index=models.Index(fields=['txid', 'id'], name='task_change_txid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskchange',
+            index=models.Index(fields=['task_id', 'id'], name='task_change_task_idx'),
+        ),
+    ]
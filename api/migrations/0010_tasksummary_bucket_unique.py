@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_taskchange_txid'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='tasksummary',
+            constraint=models.UniqueConstraint(fields=('owner', 'status', 'due_date'), name='task_summary_bucket_unique'),
+        ),
+    ]
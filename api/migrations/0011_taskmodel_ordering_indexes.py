@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+# staff lists ordered by updated_at or title had no index to read the first page from and sorted
+# the whole table. built with CREATE INDEX CONCURRENTLY on postgres, so writes to the table go
+# on while they build, which needs the migration outside a transaction
+
+INDEXES = [
+    models.Index(fields=['updated_at', 'id'], name='task_updated_idx'),
+    models.Index(fields=['title', 'id'], name='task_title_idx'),
+]
+
+
+def add_indexes(apps, schema_editor):
+    TaskModel = apps.get_model('api', 'TaskModel')
+    for index in INDEXES:
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(TaskModel, index, concurrently=True)
+        else:
+            schema_editor.add_index(TaskModel, index)
+
+
+def remove_indexes(apps, schema_editor):
+    TaskModel = apps.get_model('api', 'TaskModel')
+    for index in INDEXES:
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.remove_index(TaskModel, index, concurrently=True)
+        else:
+            schema_editor.remove_index(TaskModel, index)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0010_tasksummary_bucket_unique'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.AddIndex(model_name='taskmodel', index=index) for index in INDEXES],
+            database_operations=[migrations.RunPython(add_indexes, remove_indexes)],
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+# fills search_vector for the rows that existed before the trigger of 0005, a batch of ids
+# per UPDATE. the migration isn't atomic, so every batch commits on its own and holds its row
+# locks only while it runs, instead of one UPDATE locking the whole table until the end
+
+BATCH_SIZE = 5000
+
+BACKFILL_SQL = """
+UPDATE api_taskmodel SET title = title
+WHERE id >= %s AND id < %s AND search_vector IS NULL
+"""
+
+
+def backfill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT min(id), max(id) FROM api_taskmodel")
+        first, last = cursor.fetchone()
+        if first is None:
+            return
+
+        for start in range(first, last + 1, BATCH_SIZE):
+            cursor.execute(BACKFILL_SQL, [start, start + BATCH_SIZE])   # the trigger fills the column
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0011_taskmodel_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop, atomic=False),
+    ]
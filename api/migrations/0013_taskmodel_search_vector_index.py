@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+# the GIN index search_tasks reads, built with CREATE INDEX CONCURRENTLY so writes to the table
+# go on while it builds. that can't run in a transaction, hence atomic = False. the index is
+# postgres only and not part of TaskModel.Meta (sqlite test databases couldn't build it), so it
+# is created here rather than through AddIndexConcurrently
+
+CREATE_INDEX_SQL = "CREATE INDEX CONCURRENTLY IF NOT EXISTS task_search_vector_idx ON api_taskmodel USING GIN (search_vector)"
+
+DROP_INDEX_SQL = "DROP INDEX CONCURRENTLY IF EXISTS task_search_vector_idx"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX_SQL)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0012_taskmodel_search_vector_backfill'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index, atomic=False),
+    ]
@@ -1,14 +1,45 @@
-from django.db import models
+from django.db import models, router, transaction
 
 from datetime import timedelta
 from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Lower
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.contrib.postgres.search import SearchVectorField
+from api.signals import tasks_changed, bucket_deltas, CREATED, UPDATED, DELETED
 
 # Create your models here.
 
+TASK_SEARCH_CONFIG = 'english'   # text search configuration the search_vector trigger is built with
+
+
+def default_due_date():   # due date given to tasks created without one
+  return timezone.now().date() + timedelta(days=3)
+
+
 class User(AbstractUser):
   email = models.EmailField(unique=True)
 
+  class Meta(AbstractUser.Meta):
+    # "Alice" can't register next to "alice", and registration relies on these to settle races
+    constraints = [models.UniqueConstraint(Lower('username'), name='user_username_ci_unique'),
+                   models.UniqueConstraint(Lower('email'),    name='user_email_ci_unique'),
+                  ]
+
+
+class TaskQuerySet(models.QuerySet):
+
+  def visible_to(self, user):   # staff see every task, everyone else only their own
+    return self if user.is_staff else self.filter(owner_id=user.id)
+
+
+
+class TaskManager(models.Manager.from_queryset(TaskQuerySet)):
+
+  def get_queryset(self):
+    return super().get_queryset().defer('search_vector')   # only ever read by the database itself, never worth the transfer
+
 
 class TaskModel(models.Model):
   owner = models.ForeignKey(User,on_delete=models.CASCADE, null=False, blank=False)
@@ -21,6 +52,16 @@ class TaskModel(models.Model):
   created_at  = models.DateTimeField(auto_now_add=True)
   updated_at  = models.DateTimeField(auto_now=True) 
 
+  # title (weight A) and description (weight B) as a tsvector, filled in by a database trigger
+  # on postgres (see migration 0005), so bulk writes and imports keep it current as well
+  search_vector = SearchVectorField(null=True, editable=False)
+
+  # the due_date the owner was last told is past, set by the overdue sweep in api.jobs. a task
+  # whose due date moves is reported again once the new date has passed
+  overdue_notified_for = models.DateField(null=True, editable=False)
+
+  objects = TaskManager()
+
 
   class Meta:
     constraints = [models.UniqueConstraint(fields=['owner','title'],
@@ -28,12 +69,167 @@ class TaskModel(models.Model):
                                           )
                   ]
 
+    indexes = [models.Index(fields=['owner','status','due_date'], name='task_owner_status_due_idx'),  # user lists, every filter combination
+               models.Index(fields=['owner','created_at','id'],   name='task_owner_created_idx'),     # user lists, cursor pagination
+               models.Index(fields=['status','due_date'],         name='task_status_due_idx'),        # staff lists filtered on status
+               models.Index(fields=['due_date'],                  name='task_due_date_idx'),          # staff lists filtered on due_date only
+               models.Index(fields=['created_at','id'],           name='task_created_idx'),           # staff lists, cursor pagination
+               models.Index(fields=['updated_at','id'],           name='task_updated_idx'),           # staff lists ordered by updated_at
+               models.Index(fields=['title','id'],                name='task_title_idx'),             # staff lists ordered by title
+              ]
+
 
   def __str__(self):
     return f"task - '{self.title}' of user - '{self.owner.username}'"
   
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    instance._loaded_owner_id = instance.__dict__.get('owner_id')   # lets save() notice a change of owner
+    instance._loaded_bucket   = instance.counted_bucket()          # and move the task in the stats summary
+    return instance
+
+
+  def counted_bucket(self):
+    # (owner_id, status, due_date) the stats summary counts this task under, None when one of them isn't loaded
+    values = self.__dict__
+    if any(name not in values for name in ('owner_id','status','due_date')):
+      return None
+    return values['owner_id'], values['status'], values['due_date']
+
+
   def save(self,*args,**kwargs):
     if not self.due_date:
-      self.due_date = timezone.now().date() + timedelta(days=3)
+      self.due_date = default_due_date()
+
+    adding = self._state.adding
+    using  = kwargs.get('using') or router.db_for_write(TaskModel, instance=self)
+
+    with transaction.atomic(using=using, savepoint=False):   # the task and what the receivers write commit together
+      result = super().save(*args,**kwargs)
+
+      if adding:
+        changes = [(CREATED, self.id, self.owner_id)]
+        buckets = bucket_deltas(None, self.counted_bucket())
+      else:
+        changes = [(UPDATED, self.id, self.owner_id)]
+        previous_owner_id = getattr(self, '_loaded_owner_id', None)
+        if previous_owner_id is not None and previous_owner_id != self.owner_id:
+          changes.insert(0, (DELETED, self.id, previous_owner_id))
+
+        previous_bucket = getattr(self, '_loaded_bucket', None)   # unknown for partially loaded tasks, the summary rebuild catches up
+        buckets = bucket_deltas(previous_bucket, self.counted_bucket()) if previous_bucket else []
+
+      tasks_changed.send(sender=TaskModel, changes=changes, buckets=buckets)
+
+    self._loaded_owner_id = self.owner_id
+    self._loaded_bucket   = self.counted_bucket()
+    return result
+
+
+  def delete(self,*args,**kwargs):
+    task_id = self.id
+    using   = kwargs.get('using') or router.db_for_write(TaskModel, instance=self)
+
+    with transaction.atomic(using=using, savepoint=False):
+      result = super().delete(*args,**kwargs)
+      tasks_changed.send(sender=TaskModel, changes=[(DELETED, task_id, self.owner_id)],
+                         buckets=bucket_deltas(self.counted_bucket(), None))
+
+    return result
+
+
+
+@receiver(pre_delete, sender=User)
+def announce_cascaded_tasks(sender, instance, using, **kwargs):
+  # deleting a user takes their tasks along through the cascade, which never calls TaskModel.delete.
+  # pre_delete runs inside the deletion's transaction, so these changes commit or roll back with it.
+  # no buckets, the user's summary rows go with the same cascade
+  task_ids = TaskModel.objects.using(using).filter(owner_id=instance.id).values_list('id', flat=True)
+  changes  = [(DELETED, task_id, instance.id) for task_id in task_ids]
+  if changes:
+    tasks_changed.send(sender=TaskModel, changes=changes, buckets=[])
 
-    return super().save(*args,**kwargs)
\ No newline at end of file
+
+
+class TaskChange(models.Model):
+  # one row per task write, read by the sync feed. clients sync in (txid, id) order, see api.sync,
+  # and since deleted tasks keep their rows here until pruned deletes stay visible to them
+
+  ACTION_CHOICES = [(CREATED,'Created'), (UPDATED,'Updated'), (DELETED,'Deleted')]
+
+  task_id    = models.BigIntegerField()
+  owner_id   = models.BigIntegerField()   # plain ids, the rows outlive the task and its owner
+  action     = models.CharField(max_length=10, choices=ACTION_CHOICES)
+  changed_at = models.DateTimeField(auto_now_add=True)
+  txid       = models.BigIntegerField(default=0, editable=False)   # postgres transaction that wrote the row, 0 elsewhere
+
+
+  class Meta:
+    indexes = [models.Index(fields=['owner_id','txid','id'], name='task_change_owner_txid_idx'),   # user feeds
+               models.Index(fields=['txid','id'],            name='task_change_txid_idx'),         # staff feeds
+               models.Index(fields=['task_id','id'],         name='task_change_task_idx'),         # pruning superseded rows
+              ]
+
+
+  def __str__(self):
+    return f"task - '{self.task_id}' {self.action} at {self.changed_at}"
+
+
+
+class TaskSummary(models.Model):
+  # task counts per (owner, status, due_date), kept current by api.stats when
+  # settings.TASK_STATS_SUMMARY is on. an owner has a row per status and due date among
+  # their tasks, fewer than tasks as soon as several share a day but still growing with the
+  # date range. the stats aggregate over this table instead of every task, and the staff
+  # wide response pages over owners rather than returning all of them
+  owner    = models.ForeignKey(User, on_delete=models.CASCADE)
+  status   = models.BooleanField()
+  due_date = models.DateField(null=True)
+  count    = models.PositiveIntegerField()
+
+
+  class Meta:
+    # one row per bucket, writes add to it in place. every write path fills in due_date, so no bucket is null
+    constraints = [models.UniqueConstraint(fields=['owner','status','due_date'], name='task_summary_bucket_unique')]
+
+
+
+class Job(models.Model):
+  # one unit of background work, run by `manage.py run_jobs`. see api.jobs
+
+  QUEUED  = 'queued'
+  RUNNING = 'running'
+  DONE    = 'done'
+  FAILED  = 'failed'
+  STATUS_CHOICES = [(QUEUED,'Queued'), (RUNNING,'Running'), (DONE,'Done'), (FAILED,'Failed')]
+
+  name         = models.CharField(max_length=100)
+  payload      = models.JSONField(default=dict)
+  status       = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+  attempts     = models.PositiveSmallIntegerField(default=0)
+  max_attempts = models.PositiveSmallIntegerField()
+  run_at       = models.DateTimeField()             # not before, moved back on every retry
+  locked_at    = models.DateTimeField(null=True)    # when a worker took it
+  last_error   = models.TextField(blank=True)
+  created_at   = models.DateTimeField(auto_now_add=True)
+  finished_at  = models.DateTimeField(null=True)
+
+
+  class Meta:
+    indexes = [models.Index(fields=['status','run_at'], name='job_status_run_at_idx')]   # what workers poll
+
+
+  def __str__(self):
+    return f"job - '{self.name}' {self.status} ({self.attempts}/{self.max_attempts})"
+
+
+
+class JobSchedule(models.Model):
+  # when a job of settings.JOB_SCHEDULES is next enqueued, shared by every worker so each run is enqueued once
+  name        = models.CharField(max_length=100, unique=True)
+  next_run_at = models.DateTimeField()
+
+
+  def __str__(self):
+    return f"schedule - '{self.name}' next at {self.next_run_at}"
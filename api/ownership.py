@@ -0,0 +1,115 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from api.bulk import parse_id
+from api.models import TaskModel, default_due_date
+from api.signals import tasks_changed, bucket_deltas, UPDATED, DELETED
+
+
+# owner scoped reads and writes for the task detail views. the owner check is part of the
+# statement, so a task is read, updated or deleted in one query. only when that query finds
+# nothing does a second one tell a missing task (404) from someone else's task (403)
+
+TASK_NOT_FOUND = {"message":"Task not found"}
+ILLEGAL_ACCESS = {"message":"Illegal access"}
+
+
+def scoped_tasks(user, task_id):
+  return TaskModel.objects.visible_to(user).filter(id=parse_id(task_id))
+
+
+
+def missing_task(user, task_id):
+  # (status, body) for a task the scoped query didn't find
+  task_id = parse_id(task_id)
+  if task_id is None or user.is_staff or not TaskModel.objects.filter(id=task_id).exists():
+    return 404, TASK_NOT_FOUND
+  return 403, ILLEGAL_ACCESS
+
+
+
+async def amissing_task(user, task_id):
+  task_id = parse_id(task_id)
+  if task_id is None or user.is_staff or not await TaskModel.objects.filter(id=task_id).aexists():
+    return 404, TASK_NOT_FOUND
+  return 403, ILLEGAL_ACCESS
+
+
+
+def _scope(user, task_id, quote_name):
+  where, params = f"{quote_name('id')} = %s", [task_id]
+  if not user.is_staff:
+    where, params = f"{where} AND {quote_name('owner_id')} = %s", [task_id, user.id]
+  return where, params
+
+
+
+def update_task(user, task_id, values):
+  # UPDATE ... WHERE id (AND owner_id) RETURNING the row, so the check, the write and reading the task
+  # back for the response are one statement. values are field names mapped to validated values, the
+  # owner is left alone. returns the updated task, or None when the user can't see it
+  task_id = parse_id(task_id)
+  if task_id is None:
+    return None
+
+  values = {**values, 'updated_at':timezone.now()}
+  if 'due_date' in values and not values['due_date']:
+    values['due_date'] = default_due_date()   # as TaskModel.save does
+
+  alias      = router.db_for_write(TaskModel)
+  connection = connections[alias]
+  quote_name = connection.ops.quote_name
+  meta       = TaskModel._meta
+
+  assignments, params = [], []
+  for name, value in values.items():
+    field = meta.get_field(name)
+    assignments.append(f"{quote_name(field.column)} = %s")
+    params.append(field.get_db_prep_save(value, connection))
+
+  where, where_params = _scope(user, task_id, quote_name)
+  columns = ", ".join(quote_name(field.column) for field in meta.concrete_fields if field.name != 'search_vector')
+  sql = f"UPDATE {quote_name(meta.db_table)} SET {', '.join(assignments)} WHERE {where} RETURNING {columns}"
+
+  with transaction.atomic(using=alias):
+    before = None
+    if settings.TASK_STATS_SUMMARY and ('status' in values or 'due_date' in values):
+      # where the stats summary counts the task now, locked so it can't move before the UPDATE
+      before = scoped_tasks(user, task_id).using(alias).select_for_update().values_list('owner_id','status','due_date').first()
+
+    tasks = list(TaskModel.objects.db_manager(alias).raw(sql, params + where_params))   # raw() converts the returned columns
+    if tasks:
+      tasks_changed.send(sender=TaskModel, changes=[(UPDATED, tasks[0].id, tasks[0].owner_id)],
+                         buckets=bucket_deltas(before, tasks[0].counted_bucket()) if before else [])
+
+  return tasks[0] if tasks else None
+
+
+
+def delete_task(user, task_id):
+  # DELETE ... WHERE id (AND owner_id) RETURNING the owner and the stats bucket, nothing points at tasks so there
+  # is nothing for the cascade collector to do. returns the owner of the deleted task, or None when the user can't see it
+  task_id = parse_id(task_id)
+  if task_id is None:
+    return None
+
+  alias      = router.db_for_write(TaskModel)
+  connection = connections[alias]
+  quote_name = connection.ops.quote_name
+
+  where, params = _scope(user, task_id, quote_name)
+  columns = ", ".join(quote_name(column) for column in ('id','owner_id','status','due_date'))
+  sql = f"DELETE FROM {quote_name(TaskModel._meta.db_table)} WHERE {where} RETURNING {columns}"
+
+  with transaction.atomic(using=alias):
+    tasks = list(TaskModel.objects.db_manager(alias).raw(sql, params))
+    if tasks:
+      tasks_changed.send(sender=TaskModel, changes=[(DELETED, task_id, tasks[0].owner_id)],
+                         buckets=bucket_deltas(tasks[0].counted_bucket(), None))
+
+  return tasks[0].owner_id if tasks else None
+
+
+adelete_task = sync_to_async(delete_task)
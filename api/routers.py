@@ -0,0 +1,118 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+# primary/replica routing.
+#
+# task reads made while serving a request go to one of settings.DATABASE_REPLICAS, everything
+# else goes to the primary: writes, reads inside a transaction, reads of any other model, and
+# everything outside a request (management commands, workers). once a request writes, its
+# remaining reads are pinned to the primary, and so are the reads of the same user for
+# DATABASE_REPLICA_PIN_SECONDS afterwards, so nobody reads their own write from a lagging replica.
+# the pin is kept in the cache, which has to be shared between processes for the user's next
+# request to see it wherever it lands (api.checks refuses local memory with replicas configured)
+
+REPLICA_MODELS = {'api.taskmodel', 'api.taskchange'}
+
+_request_state = ContextVar('db_request_state', default=None)
+
+
+def _in_transaction():
+  # the blocks TestCase wraps every test in don't count, as for Django's own durable check
+  return any(not block._from_testcase for block in transaction.get_connection(DEFAULT_DB_ALIAS).atomic_blocks)
+
+
+
+class PrimaryReplicaRouter:
+
+  def db_for_read(self, model, **hints):
+    state = _request_state.get()
+
+    if state is None or state['pinned'] or model._meta.label_lower not in REPLICA_MODELS:
+      return DEFAULT_DB_ALIAS
+
+    if _in_transaction():   # read-modify-write, must see the primary's rows
+      return DEFAULT_DB_ALIAS
+
+    if state['replica'] is None:   # one replica per request, so its reads agree with each other
+      state['replica'] = random.choice(settings.DATABASE_REPLICAS)
+    return state['replica']
+
+
+  def db_for_write(self, model, **hints):
+    state = _request_state.get()
+    if state is not None:
+      state['pinned'] = state['wrote'] = True
+    return DEFAULT_DB_ALIAS
+
+
+  def allow_relation(self, obj1, obj2, **hints):   # replicas hold the same data as the primary
+    return True
+
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):   # replicas get the schema through replication
+    return db == DEFAULT_DB_ALIAS
+
+
+
+def _pin_key(request):
+  # the user the access token was issued to, so every token and device of theirs is pinned. the
+  # middleware runs before authentication, a token that doesn't verify pins nothing
+  header = request.META.get('HTTP_AUTHORIZATION', '').split()
+  if len(header) != 2 or header[0] not in api_settings.AUTH_HEADER_TYPES:
+    return None
+
+  try:
+    user_id = AccessToken(header[1])[api_settings.USER_ID_CLAIM]
+  except (TokenError, KeyError):
+    return None
+  return f"db:pinned:{user_id}"
+
+
+
+@sync_and_async_middleware
+def replica_pinning_middleware(get_response):
+  if not settings.DATABASE_REPLICAS:
+    raise MiddlewareNotUsed
+
+  if iscoroutinefunction(get_response):
+    async def middleware(request):
+      key   = _pin_key(request)
+      state = {"pinned":bool(key and await cache.aget(key)), "wrote":False, "replica":None}
+
+      token = _request_state.set(state)
+      try:
+        response = await get_response(request)
+      finally:
+        _request_state.reset(token)
+
+      if state['wrote'] and key:
+        await cache.aset(key, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+      return response
+
+  else:
+    def middleware(request):
+      key   = _pin_key(request)
+      state = {"pinned":bool(key and cache.get(key)), "wrote":False, "replica":None}
+
+      token = _request_state.set(state)
+      try:
+        response = get_response(request)
+      finally:
+        _request_state.reset(token)
+
+      if state['wrote'] and key:
+        cache.set(key, True, settings.DATABASE_REPLICA_PIN_SECONDS)
+      return response
+
+  return middleware
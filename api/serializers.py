@@ -1,8 +1,17 @@
 from rest_framework import serializers
+from django.utils import timezone
 from api.models import User
 from api.models import TaskModel
-from django.db import IntegrityError
-from rest_framework_simplejwt.tokens import RefreshToken,TokenError
+from api.bulk import parse_id
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
+from django.contrib.auth.hashers import make_password
+from rest_framework_simplejwt.tokens import TokenError
+from api.tokens import TaskRefreshToken
+from api.metrics import timed_serialization
+from api.hashers import password_slot
 
 class RegisterSerializer(serializers.ModelSerializer):
 
@@ -14,28 +23,54 @@ class RegisterSerializer(serializers.ModelSerializer):
     model = User
     fields = ['username', 'password', 'email']
 
-  def validate_username(self,value):
-    if User.objects.filter(username=value).exists():
-      raise serializers.ValidationError('Username already exists')
-    return value
-    
-  def validate_email(self,value):
-    if User.objects.filter(email=value).exists():
-      raise serializers.ValidationError("Email already exists")
-    return value
+  def validate(self, attrs):
+    # both fields in one query, compared the way the unique constraints compare them. this only
+    # spares a taken name the password hashing, the constraints settle concurrent registrations
+    username, email = Lower(Value(attrs['username'])), Lower(Value(attrs['email']))
+    taken = (User.objects.filter(Q(Exact(Lower('username'), username)) | Q(Exact(Lower('email'), email)))
+                         .annotate(username_taken=Exact(Lower('username'), username), email_taken=Exact(Lower('email'), email))
+                         .values('username_taken','email_taken')[:2])
+
+    errors = {}
+    for row in taken:
+      if row['username_taken']:
+        errors['username'] = "Username already exists"
+      if row['email_taken']:
+        errors['email'] = "Email already exists"
+
+    if errors:
+      raise serializers.ValidationError(errors)
+    return attrs
 
   def create(self, validated_data):
+    with password_slot():   # only the hashing, the slot is free again before the insert
+      password = make_password(validated_data['password'])
+
+    user = User(username=User.normalize_username(validated_data['username']),
+                email=User.objects.normalize_email(validated_data['email']),
+                password=password
+               )
     try:
-      user = User.objects.create_user(username=validated_data['username'],
-                                      email=validated_data['email'],
-                                      password=validated_data['password']
-                                     )
-    except IntegrityError:
-      raise serializers.ValidationError({"detail":"Username or email already exists"})
-    
+      with transaction.atomic():   # a savepoint when called inside a transaction, so a duplicate doesn't break it
+        user.save(force_insert=True)
+    except IntegrityError as exc:   # registered by someone else since validate()
+      raise serializers.ValidationError(duplicate_errors(exc))
+
     return user
 
 
+
+def duplicate_errors(exc):
+  # the field whose unique constraint failed. postgres names the constraint, sqlite the index or column
+  diag = getattr(exc.__cause__, 'diag', None)
+  name = getattr(diag, 'constraint_name', None) or str(exc)
+  if 'email' in name:
+    return {"email":["Email already exists"]}
+  if 'username' in name:
+    return {"username":["Username already exists"]}
+  return {"detail":"Username or email already exists"}
+
+
 class LoginSerializer(serializers.ModelSerializer):
   username = serializers.CharField()
   password = serializers.CharField(write_only=True)
@@ -51,7 +86,7 @@ class LogoutSerializer(serializers.Serializer):
     token = attrs.get('refresh')
 
     try:
-      self.token = RefreshToken(token)
+      self.token = TaskRefreshToken(token)
     except TokenError:
       raise serializers.ValidationError("Invalid or expired refresh token.")
     
@@ -67,36 +102,62 @@ class LogoutSerializer(serializers.Serializer):
 
 
 
+class TimedListSerializer(serializers.ListSerializer):   # many=True task serializers, timed for the performance metrics
+
+  @property
+  def data(self):
+    with timed_serialization():
+      return super().data
+
+
+
 class TaskSerializer(serializers.ModelSerializer):
 
   class Meta:
     model = TaskModel
     fields = ['title','description','status','owner','due_date','created_at']
     read_only_fields = ['owner','created_at','updated_at']
+    list_serializer_class = TimedListSerializer
+
+
+  @property
+  def data(self):
+    with timed_serialization():
+      return super().data
 
 
-  def _get_owner(self):  # helper method to configure owner of a task 
+  def _get_owner_id(self):  # helper method to configure owner of a task, works on ids so request.user never has to be a model instance
     request = self.context['request']
 
     if request.user.is_staff:
       owner_id = self.initial_data.get('owner')
       if owner_id:
-        try:
-          return User.objects.get(id=owner_id)
-        except User.DoesNotExist:
-          raise serializers.ValidationError({"owner":"User with this ID does not exist"})
+        if not hasattr(self, '_owner_id'):   # validate() and save() both ask, look the owner up once
+          self._owner_id = parse_id(owner_id)
+          if self._owner_id is None or not User.objects.filter(id=self._owner_id).exists():
+            raise serializers.ValidationError({"owner":"User with this ID does not exist"})
+        return self._owner_id
       else:
-        return request.user
+        return request.user.id
     else:
-      return request.user
+      return request.user.id
 
 
 
   def validate(self, attrs):
-    title  = attrs.get("title")
-    owner = self._get_owner()
+    request = self.context['request']
+    owner_given = request.user.is_staff and bool(self.initial_data.get('owner'))
+
+    if self.instance and not owner_given:
+      if attrs.get('title', self.instance.title) == self.instance.title:
+        return attrs   # neither half of (owner, title) changes, e.g. a PUT resending the whole task
+      if self.context.get('title_checked_on_write'):
+        return attrs   # the view's UPDATE runs into unique_task_per_user instead, stand ins carry only the id
+
+    title    = attrs.get("title", self.instance.title if self.instance else None)   # a new owner keeps the current title
+    owner_id = self.instance.owner_id if self.instance and not owner_given else self._get_owner_id()
 
-    task_query_set = TaskModel.objects.filter(title=title,owner=owner)   # checking for duplication attempt of a task
+    task_query_set = TaskModel.objects.filter(title=title,owner_id=owner_id)   # checking for duplication attempt of a task
 
     if self.instance:   # in case of updation
       task_query_set = task_query_set.exclude(id=self.instance.id)
@@ -109,9 +170,7 @@ class TaskSerializer(serializers.ModelSerializer):
 
 
   def create(self, validated_data):
-    request = self.context['request']
-
-    validated_data['owner'] = self._get_owner()
+    validated_data['owner_id'] = self._get_owner_id()
     try:
       return super().create(validated_data)
     except IntegrityError:
@@ -126,13 +185,103 @@ class TaskSerializer(serializers.ModelSerializer):
       raise serializers.ValidationError("Request context is required")
     
     if request.user.is_staff and 'owner' in self.initial_data:
-      validated_data['owner'] = self._get_owner()
+      validated_data['owner_id'] = self._get_owner_id()
 
     for attr,value in validated_data.items():
       setattr(instance, attr, value)
     
     try:  
-      instance.save()
+      instance.save(update_fields=[*validated_data, 'updated_at'])   # only the columns the request changed
       return instance
     except IntegrityError:
       raise serializers.ValidationError({"detail":"You already have a task with this title"})
+
+
+
+class TaskBulkSerializer(TaskSerializer):
+  # field level validation of one item of a bulk request. owner lookups and the
+  # duplicate title check are done once for the whole batch by the bulk views
+
+  class Meta(TaskSerializer.Meta):
+    fields = ['id'] + TaskSerializer.Meta.fields
+
+  def validate(self, attrs):
+    return attrs
+
+
+
+def _iso_date(value):
+  return value.isoformat() if value is not None else None
+
+
+def _iso_datetime(value, tz):   # same output as DRF's DateTimeField
+  if value is None:
+    return None
+  value = value.astimezone(tz).isoformat()
+  return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+
+class LeanTaskSerializer:
+  # read only fast path for list pages. the page is fetched with values() on just the
+  # columns the response needs and every row becomes a dict directly, no model instances
+  # and no DRF fields. the output matches TaskSerializer exactly, expand=owner nests {id, username, email}
+
+  fields = TaskSerializer.Meta.fields
+  page_columns = ['id','created_at','updated_at']   # always fetched, cursor pagination and the validators read them
+
+  def __init__(self, fields=None, expand_owner=False):
+    self.output_fields = fields or self.fields
+    self.expand_owner  = expand_owner
+
+
+  @classmethod
+  def from_request(cls, request):
+    requested = request.query_params.get('fields')
+    if requested is None:
+      return cls(expand_owner=request.query_params.get('expand') == 'owner')
+
+    fields = [field.strip() for field in requested.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in cls.fields]
+    if not fields or unknown:
+      raise serializers.ValidationError({"fields":f"Choose from {', '.join(cls.fields)}"})
+
+    return cls([field for field in cls.fields if field in fields], expand_owner=request.query_params.get('expand') == 'owner')
+
+
+  def columns(self):
+    columns = list(self.page_columns)
+    for field in self.output_fields:
+      if field == 'owner':
+        columns += ['owner_id','owner__username','owner__email'] if self.expand_owner else ['owner_id']
+      elif field not in columns:
+        columns.append(field)
+    return columns
+
+
+  def rows(self, tasks):
+    return tasks.values(*self.columns())
+
+
+  def to_representation(self, rows):
+    output_fields = self.output_fields
+    tz = timezone.get_current_timezone()   # looked up once per page, it is slower than the formatting itself
+    formatters = {'due_date':_iso_date,
+                  'created_at':lambda value: _iso_datetime(value, tz)
+                 }
+    data = []
+
+    with timed_serialization():
+      for row in rows:
+        task = {}
+        for field in output_fields:
+          if field == 'owner':
+            task['owner'] = ({"id":row['owner_id'], "username":row['owner__username'], "email":row['owner__email']}
+                             if self.expand_owner else row['owner_id'])
+          elif field in formatters:
+            task[field] = formatters[field](row[field])
+          else:
+            task[field] = row[field]
+        data.append(task)
+
+    return data
@@ -0,0 +1,23 @@
+from django.dispatch import Signal
+
+
+# sent after tasks are written. TaskModel.save/delete send it for single tasks and the
+# bulk paths, which skip those methods, send it themselves. receivers get
+# changes=[(action, task_id, owner_id), ...], a task moved to another owner shows up as
+# deleted for the old owner and updated for the new one.
+#
+# senders also pass buckets=[(owner_id, status, due_date, delta), ...], how the write moved
+# the task counts of api.stats: -1 where a task was counted before, +1 where it is now
+
+tasks_changed = Signal()
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+
+
+def bucket_deltas(before, after):
+  # buckets for a task counted under `before` and now under `after`, (owner_id, status, due_date) or None
+  if before == after:
+    return []
+  return [(*bucket, delta) for bucket, delta in ((before, -1), (after, 1)) if bucket is not None]
@@ -0,0 +1,163 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.utils.urls import replace_query_param
+
+from api.bulk import parse_id
+from api.models import User, TaskModel, TaskSummary
+from api.signals import tasks_changed
+
+
+# dashboard numbers, always a single aggregate query. it runs over the tasks themselves, or
+# over TaskSummary when settings.TASK_STATS_SUMMARY is on
+
+STAT_NAMES = ['total', 'completed', 'pending', 'overdue', 'due_this_week']
+
+OWNERS_PAGE_SIZE     = 100    # owners per staff stats page
+MAX_OWNERS_PAGE_SIZE = 1000
+
+
+def stat_expressions(today, measure):
+  # overdue and due this week only count pending tasks, the week ends on sunday
+  week_end = today + timedelta(days=6 - today.weekday())
+
+  return {"total":measure(None),
+          "completed":measure(Q(status=True)),
+          "pending":measure(Q(status=False)),
+          "overdue":measure(Q(status=False, due_date__lt=today)),
+          "due_this_week":measure(Q(status=False, due_date__gte=today, due_date__lte=week_end))
+         }
+
+
+
+def task_stats(request):
+  today = timezone.localdate()
+
+  if settings.TASK_STATS_SUMMARY:
+    rows = TaskSummary.objects.all()
+    expressions = stat_expressions(today, lambda condition: Coalesce(Sum('count', filter=condition), 0))
+  else:
+    rows = TaskModel.objects.all()
+    expressions = stat_expressions(today, lambda condition: Count('id', filter=condition))
+
+  owner = request.query_params.get('owner')
+  if owner is not None:
+    if not request.user.is_staff:
+      raise PermissionDenied({"message":"Request not allowed"})
+    if parse_id(owner) is None:
+      raise ValidationError({"owner":"Owner must be a user id"})
+    rows = rows.filter(owner_id=parse_id(owner))
+
+  if not request.user.is_staff:
+    return {"date":today, "totals":rows.filter(owner_id=request.user.id).aggregate(**expressions)}
+
+  # staff get the totals from one aggregate and a page of owners, ordered by id, from one grouped
+  # query. a page starts after the last owner of the previous one, so no page reads rows of the pages before it
+  after, page_size = owners_page(request)
+  owners = rows.filter(owner_id__gt=after) if after is not None else rows
+  owners = list(owners.values('owner_id').annotate(**expressions).order_by('owner_id')[:page_size + 1])   # one extra row tells us whether a next page exists
+
+  next_link = None
+  if len(owners) > page_size:
+    owners    = owners[:page_size]
+    next_link = replace_query_param(request.build_absolute_uri(), 'after', owners[-1]['owner_id'])
+
+  return {"date":today,
+          "totals":rows.aggregate(**expressions),
+          "owners":[{"owner":row['owner_id'], **{name:row[name] for name in STAT_NAMES}} for row in owners],
+          "next":next_link
+         }
+
+
+
+def owners_page(request):
+  # (after, page_size) of a staff stats page, from ?after=<owner id>&page_size=<n>
+  after     = request.query_params.get('after')
+  page_size = request.query_params.get('page_size')
+
+  if after is not None and parse_id(after) is None:
+    raise ValidationError({"after":"Must be an owner id"})
+  if page_size is not None and (parse_id(page_size) is None or parse_id(page_size) < 1):
+    raise ValidationError({"page_size":"Must be a positive integer"})
+
+  return (parse_id(after) if after is not None else None,
+          min(parse_id(page_size), MAX_OWNERS_PAGE_SIZE) if page_size is not None else OWNERS_PAGE_SIZE)
+
+
+
+def refresh_summary(owner_ids):
+  # recounts the summary rows of the given owners from their tasks, one grouped query for all of them.
+  # the rows are locked before the count and rewritten in place: a write that already moved one of them
+  # is waited for and counted, a write after it adds its delta on top of the new count
+  owner_ids = sorted(owner_ids)
+  if not owner_ids:
+    return
+
+  with transaction.atomic():
+    rows = TaskSummary.objects.select_for_update().filter(owner_id__in=owner_ids).order_by('owner_id','status','due_date')
+    existing = {(row.owner_id, row.status, row.due_date):row for row in rows}
+
+    counts = (TaskModel.objects.filter(owner_id__in=owner_ids)
+                               .values('owner_id','status','due_date')
+                               .annotate(count=Count('id'))
+                               .order_by()
+             )
+    counts = {(row['owner_id'], row['status'], row['due_date']):row['count'] for row in counts}
+
+    for bucket, row in existing.items():
+      row.count = counts.get(bucket, 0)
+    TaskSummary.objects.filter(id__in=[row.id for row in existing.values() if not row.count]).delete()
+    TaskSummary.objects.bulk_update([row for row in existing.values() if row.count], ['count'], batch_size=1000)
+
+    TaskSummary.objects.bulk_create([TaskSummary(owner_id=owner_id, status=status, due_date=due_date, count=count)
+                                     for (owner_id, status, due_date), count in counts.items()
+                                     if (owner_id, status, due_date) not in existing
+                                    ], update_conflicts=True, unique_fields=['owner','status','due_date'], update_fields=['count'])
+
+
+
+def add_to_summary(buckets):
+  # adds the deltas of a write to just the (owner, status, due_date) rows it moved, in the writer's transaction.
+  # rows are locked in the same order rebuilds lock them, so two writers never wait on each other crosswise
+  totals = {}
+  for owner_id, status, due_date, delta in buckets:
+    totals[(owner_id, status, due_date)] = totals.get((owner_id, status, due_date), 0) + delta
+
+  for (owner_id, status, due_date), delta in sorted(totals.items(), key=lambda item: (*item[0][:2], item[0][2] or date.max)):
+    rows = TaskSummary.objects.filter(owner_id=owner_id, status=status, due_date=due_date)
+    if not delta or rows.update(count=Greatest(F('count') + delta, 0)) or delta < 0:
+      continue
+
+    _, created = TaskSummary.objects.get_or_create(owner_id=owner_id, status=status, due_date=due_date, defaults={"count":delta})
+    if not created:   # another writer added the bucket in between
+      rows.update(count=F('count') + delta)
+
+
+
+def rebuild_summary(batch_size=1000):
+  owner_ids = User.objects.order_by('id').values_list('id', flat=True)
+  refreshed = 0
+
+  batch = []
+  for owner_id in owner_ids.iterator(chunk_size=batch_size):
+    batch.append(owner_id)
+    if len(batch) == batch_size:
+      refresh_summary(batch)
+      refreshed += len(batch)
+      batch = []
+
+  refresh_summary(batch)
+  return refreshed + len(batch)
+
+
+
+@receiver(tasks_changed)
+def update_summary(sender, changes, buckets=(), **kwargs):
+  if settings.TASK_STATS_SUMMARY and buckets:
+    add_to_summary(buckets)
@@ -0,0 +1,123 @@
+import base64
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import BigIntegerField, Exists, Func, OuterRef, Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.models import TaskChange
+from api.signals import tasks_changed, DELETED
+
+
+# change log behind the sync feed, every task write adds rows to TaskChange in the same
+# transaction as the write itself (TaskModel.save/delete and the bulk paths are atomic).
+#
+# ids are handed out when a row is inserted but transactions commit in any order, so a
+# cursor on the id alone would step over a row whose transaction commits after a later
+# one. on postgres every row carries the id of the transaction that wrote it and the feed
+# only returns rows of transactions older than the oldest one still running
+# (pg_snapshot_xmin), in (txid, id) order. nothing can commit behind a cursor anymore, at
+# the price of a long running transaction holding the feed back until it ends. other
+# databases (sqlite test runs) commit one writer at a time, there txid is 0 and ids are enough
+
+
+class CurrentTransactionId(Func):
+  template     = '0'
+  output_field = BigIntegerField()
+
+  def as_postgresql(self, compiler, connection, **extra_context):
+    return self.as_sql(compiler, connection, template='pg_current_xact_id()::text::bigint', **extra_context)
+
+
+
+class OldestRunningTransactionId(Func):   # postgres only, anything below it has committed or rolled back
+  template     = 'pg_snapshot_xmin(pg_current_snapshot())::text::bigint'
+  output_field = BigIntegerField()
+
+
+
+class CursorExpired(Exception):
+  pass
+
+
+
+@receiver(tasks_changed)
+def record_task_changes(sender, changes, **kwargs):
+  TaskChange.objects.bulk_create([TaskChange(task_id=task_id, owner_id=owner_id, action=action, txid=CurrentTransactionId())
+                                  for action, task_id, owner_id in changes
+                                  if task_id is not None
+                                 ])
+
+
+
+def encode_cursor(txid, seq):
+  # the position of the last change a client has plus when it got it, old cursors may point into pruned history
+  position = f"{txid}|{seq}|{int(time.time())}"
+  return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+
+
+def decode_cursor(encoded):
+  # (txid, id) to read on from, (0, 0) for a first sync. ValueError for anything that isn't a cursor
+  if not encoded or encoded == '0':
+    return 0, 0
+
+  txid, seq, issued = (int(part) for part in base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|'))
+  if time.time() - issued > settings.TASK_SYNC_CURSOR_DAYS * 86400:
+    raise CursorExpired()
+
+  return txid, seq
+
+
+
+def read_changes(request, position, limit):
+  # the next batch of changes after the cursor, collapsed to the latest action per task
+  txid, seq = position
+
+  changes = TaskChange.objects.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=seq)).order_by('txid','id')
+  if not request.user.is_staff:
+    changes = changes.filter(owner_id=request.user.id)
+  if connections[changes.db].vendor == 'postgresql':
+    changes = changes.filter(txid__lt=OldestRunningTransactionId())
+
+  batch    = list(changes.values_list('txid','id','task_id','action')[:limit + 1])
+  has_more = len(batch) > limit
+  batch    = batch[:limit]
+
+  latest = {}
+  for _, _, task_id, action in batch:
+    latest[task_id] = action
+
+  if batch:
+    txid, seq = batch[-1][:2]
+
+  return {"cursor":encode_cursor(txid, seq),
+          "has_more":has_more,
+          "latest":latest
+         }
+
+
+
+def prune_changes(batch_size=5000):
+  # drops the history no cursor younger than TASK_SYNC_CURSOR_DAYS can still need: tombstones and rows a later
+  # change of the same task supersedes. the latest row of every live task stays, so a sync from the start is
+  # always complete. a day of margin covers transactions still open when the oldest accepted cursor was issued
+  cutoff = timezone.now() - timedelta(days=settings.TASK_SYNC_CURSOR_DAYS + 1)
+  newer  = TaskChange.objects.filter(task_id=OuterRef('task_id'), id__gt=OuterRef('id'))
+  stale  = TaskChange.objects.filter(Q(action=DELETED) | Exists(newer), changed_at__lt=cutoff).order_by('id')
+
+  pruned  = 0
+  last_id = 0
+  while True:
+    ids = list(stale.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+    if not ids:
+      return pruned
+
+    with transaction.atomic():
+      TaskChange.objects.filter(id__in=ids).delete()
+
+    pruned += len(ids)
+    last_id = ids[-1]
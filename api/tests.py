@@ -1,3 +1,779 @@
-from django.test import TestCase
+import itertools
+import json
+import re
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from api.checks import check_shared_cache
+from api.filters import ORDERING_FIELDS, TaskFilterSerializer
+from api.metrics import measure_query
+from api.models import User, TaskModel, TaskChange, TaskSummary
+from api.tokens import TaskRefreshToken
+from api.stats import rebuild_summary
+from api.sync import prune_changes
 
 # Create your tests here.
+
+
+@override_settings(THROTTLING_ENABLED=False)
+class TaskIndexTests(TestCase):
+
+  @classmethod
+  def setUpTestData(cls):
+    # 100 owners with 100 tasks each, due dates spread over a year from 100 days ago, one done
+    # and one open task on every date, so every filter combination below finds rows
+    users = User.objects.bulk_create([User(username=f"user{number}", email=f"user{number}@example.com") for number in range(100)])
+    today = timezone.localdate()
+    TaskModel.objects.bulk_create([TaskModel(owner=user, title=f"task {number}", status=number % 2 == 0, due_date=today + timedelta(days=number // 2 * 7 - 100))
+                                   for user in users for number in range(100)
+                                  ], batch_size=2000)
+    cls.owner, cls.other = users[:2]
+    cls.staff = User.objects.create(username="admin", email="admin@example.com", is_staff=True)
+
+    with connection.cursor() as cursor:
+      cursor.execute("ANALYZE")
+
+
+  def list_plan(self, user, params):
+    # the plan of the last task query the list view runs for these query params: the page, or
+    # the count when nothing matches
+    client = APIClient()
+    client.force_authenticate(user)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(client.get('/api/tasks/list/', params).status_code, 200)
+    query = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT') and 'api_taskmodel' in query['sql']][-1]
+
+    explain = "EXPLAIN" if connection.vendor == 'postgresql' else "EXPLAIN QUERY PLAN"
+    with connection.cursor() as cursor:
+      cursor.execute(f"{explain} {query}")
+      return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+
+
+  def filter_cases(self):
+    # every filter TaskFilterSerializer accepts with a value that finds rows, grouped by what they narrow
+    due     = str(timezone.localdate() + timedelta(days=40))
+    created = timezone.now()
+    samples = {"owner":          [self.owner.id],
+               "owner__in":      [f"{self.owner.id},{self.other.id}"],
+               "due_date":       [due],
+               "due_date__gte":  [due],
+               "due_date__lte":  [due],
+               "created_at__gte":[(created - timedelta(days=1)).isoformat()],
+               "created_at__lte":[(created + timedelta(days=1)).isoformat()],
+               "overdue":        ["true","false"],
+               "ordering":       [prefix + field for field in ORDERING_FIELDS for prefix in ("","-")],
+              }
+    self.assertEqual(set(samples), set(TaskFilterSerializer().fields), "a new filter needs sample values here")
+
+    def choices(*names):   # no filter, or one of the named ones
+      return [{}] + [{name:value} for name in names for value in samples[name]]
+
+    owners    = choices("owner", "owner__in")
+    dates     = choices("due_date", "due_date__gte", "due_date__lte", "created_at__gte", "created_at__lte", "overdue")
+    statuses  = [{}, {"status":"true"}, {"status":"false"}]
+    orderings = choices("ordering") + [{"pagination":"cursor"}]   # cursor pages have their own fixed order
+
+    for user in (self.owner, self.staff):
+      for groups in itertools.product(owners if user.is_staff else [{}], statuses, dates, orderings):   # owner filters are staff only
+        yield user, {name:value for group in groups for name, value in group.items()}
+
+
+  def test_the_list_indexes_exist(self):
+    with connection.cursor() as cursor:
+      constraints = connection.introspection.get_constraints(cursor, TaskModel._meta.db_table)
+
+    indexes = {name:constraint['columns'] for name, constraint in constraints.items() if constraint['index']}
+    for index in TaskModel._meta.indexes:
+      self.assertEqual(indexes.get(index.name), [TaskModel._meta.get_field(field).column for field in index.fields])
+
+
+  def test_every_filter_combination_uses_an_index(self):
+    for user, params in self.filter_cases():
+      with self.subTest(staff=user.is_staff, **params):
+        plan = self.list_plan(user, params)
+        self.assertRegex(plan, r"Index|INDEX")
+        self.assertNotIn("Seq Scan", plan)   # postgres
+        self.assertNotRegex(plan, r"SCAN api_taskmodel$")   # sqlite, a scan without an index
+
+
+
+class QueryCountMixin:
+
+  @contextmanager
+  def assertNumStatements(self, number):
+    # assertNumQueries without the SAVEPOINTs an atomic block gets inside the transaction TestCase wraps
+    # every test in, outside tests the same block is a BEGIN/COMMIT, which isn't counted either
+    with CaptureQueriesContext(connection) as captured:
+      yield
+
+    statements = [query['sql'] for query in captured.captured_queries if not re.match(r'(RELEASE )?SAVEPOINT', query['sql'])]
+    self.assertEqual(len(statements), number, statements)
+
+
+
+class TaskQueryCountTests(QueryCountMixin, TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user  = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.staff = User.objects.create_user(username="admin", email="admin@example.com", password="password-123", is_staff=True)
+    self.tasks = [TaskModel.objects.create(owner=self.user, title=f"task {number}") for number in range(7)]
+
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+    self.staff_client = APIClient()
+    self.staff_client.force_authenticate(self.staff)
+
+
+  def test_a_list_page_is_a_count_and_the_page(self):
+    with self.assertNumQueries(2):
+      response = self.staff_client.get('/api/tasks/list/', {"expand":"owner"})
+
+    self.assertEqual(response.data['count'], 7)
+    self.assertEqual(response.data['results'][0]['owner']['username'], "alice")   # joined, not looked up per row
+
+
+  def test_an_empty_list_is_one_query(self):
+    with self.assertNumQueries(1):
+      response = self.staff_client.get('/api/tasks/list/', {"owner":self.staff.id})
+    self.assertEqual(response.data['message'], "No tasks found")
+
+
+  def test_a_cursor_page_is_one_query(self):
+    with self.assertNumQueries(1):
+      response = self.client.get('/api/tasks/list/', {"pagination":"cursor", "page_size":5})
+    self.assertEqual(len(response.data['results']), 5)
+
+
+  def test_detail_reads_and_writes(self):
+    task = self.tasks[0]
+
+    with self.assertNumQueries(1):
+      self.assertEqual(self.client.get(f'/api/tasks/retrieve/{task.id}/').status_code, 200)
+
+    with self.assertNumStatements(2):   # the UPDATE and its change log row
+      self.assertEqual(self.client.put(f'/api/tasks/update/{task.id}/', {"status":True}, format='json').status_code, 200)
+
+    with self.assertNumStatements(2):   # the DELETE and its change log row
+      self.assertEqual(self.client.delete(f'/api/tasks/delete/{task.id}/').status_code, 204)
+
+
+
+class OwnerScopedDetailTests(QueryCountMixin, TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.alice, self.bob, self.staff = [User.objects.create_user(username=name, email=f"{name}@example.com", password="password-123", is_staff=name == "admin")
+                                        for name in ("alice","bob","admin")]
+    self.task = TaskModel.objects.create(owner=self.alice, title="first")
+
+    self.clients = {}
+    for user in (self.alice, self.bob, self.staff):
+      self.clients[user.username] = APIClient()
+      self.clients[user.username].force_authenticate(user)
+
+
+  def test_the_owner_check_is_part_of_the_read(self):
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.clients["alice"].get(f'/api/tasks/retrieve/{self.task.id}/').status_code, 200)
+    self.assertEqual(len(queries), 1)
+    self.assertIn('"owner_id" =', queries[0]['sql'])
+
+    with self.assertNumQueries(1):   # staff read any task
+      self.assertEqual(self.clients["admin"].get(f'/api/tasks/retrieve/{self.task.id}/').status_code, 200)
+
+
+  def test_someone_elses_task_costs_one_more_query(self):
+    bob = self.clients["bob"]
+
+    with self.assertNumQueries(2):   # the scoped read finds nothing, the second query tells 403 from 404
+      response = bob.get(f'/api/tasks/retrieve/{self.task.id}/')
+    self.assertEqual((response.status_code, response.data), (403, {"message":"Illegal access"}))
+
+    with self.assertNumQueries(2):
+      self.assertEqual(bob.get('/api/tasks/retrieve/999/').status_code, 404)
+
+
+  def test_writes_to_someone_elses_task_change_nothing(self):
+    bob = self.clients["bob"]
+
+    with self.assertNumStatements(2):   # the UPDATE matches no row, then the existence check
+      self.assertEqual(bob.put(f'/api/tasks/update/{self.task.id}/', {"title":"taken over"}, format='json').status_code, 403)
+
+    with self.assertNumStatements(2):
+      self.assertEqual(bob.delete(f'/api/tasks/delete/{self.task.id}/').status_code, 403)
+
+    self.assertEqual(TaskModel.objects.get().title, "first")
+    self.assertEqual(TaskChange.objects.count(), 1)   # only the create
+
+
+  def test_async_updates_save_only_the_sent_fields(self):
+    put     = async_to_sync(self.async_client.put)
+    headers = {"Authorization":f"Bearer {TaskRefreshToken.for_user(self.staff).access_token}"}
+
+    with mock.patch.object(TaskModel, 'save', autospec=True, side_effect=TaskModel.save) as save:
+      for data in ({"status":True}, {"owner":self.bob.id}):
+        response = put(f'/api/async/tasks/update/{self.task.id}/', data, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    self.assertEqual([sorted(call.kwargs['update_fields']) for call in save.call_args_list], [['status','updated_at'], ['owner_id','updated_at']])
+    self.assertEqual(TaskModel.objects.values_list('owner_id','status').get(), (self.bob.id, True))
+
+
+
+class BulkTaskTests(QueryCountMixin, TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user   = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+    self.tasks  = [TaskModel.objects.create(owner=self.user, title=f"task {number}") for number in range(3)]
+
+
+  def test_delete_reports_repeated_ids(self):
+    ids = [task.id for task in self.tasks]
+
+    with self.assertNumStatements(3):   # owners, DELETE ... RETURNING, change log
+      response = self.client.delete('/api/tasks/bulk/delete/', {"ids":[ids[0], ids[1], ids[0], 0]}, format='json')
+
+    self.assertEqual(response.data['deleted'], ids[:2])
+    self.assertEqual(response.data['errors'], [{"index":2, "errors":{"id":"Task appears more than once in the request"}},
+                                               {"index":3, "errors":{"message":"Task not found"}},
+                                              ])
+    self.assertEqual(list(TaskModel.objects.values_list('id', flat=True)), ids[2:])
+
+
+  def test_a_cleared_due_date_gets_the_default_as_in_a_single_update(self):
+    task = self.tasks[0]
+    self.client.put(f'/api/tasks/update/{task.id}/', {"title":task.title, "due_date":None}, format='json')
+    single = TaskModel.objects.get(id=task.id).due_date
+
+    response = self.client.put('/api/tasks/bulk/update/', [{"id":self.tasks[1].id, "due_date":None}], format='json')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertIsNotNone(single)
+    self.assertEqual(TaskModel.objects.get(id=self.tasks[1].id).due_date, single)
+
+
+
+@override_settings(TASK_EXPORT_CHUNK_SIZE=500)
+class ExportTests(TestCase):
+
+  def setUp(self):
+    self.user   = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+    self.seeded = 0
+
+
+  def seed(self, count):
+    TaskModel.objects.bulk_create([TaskModel(owner=self.user, title=f"task {number}", description="x" * 100, due_date=timezone.localdate())
+                                   for number in range(self.seeded, self.seeded + count)
+                                  ], batch_size=5000)
+    self.seeded += count
+
+
+  def export(self, output):
+    # (peak traced memory, bytes streamed, lines streamed) of consuming the export chunk by chunk
+    tracemalloc.start()
+    try:
+      response = self.client.get('/api/tasks/export/', {"output":output})
+      streamed = lines = 0
+      for chunk in response.streaming_content:
+        streamed += len(chunk)
+        lines    += chunk.count(b"\n")
+      return tracemalloc.get_traced_memory()[1], streamed, lines
+    finally:
+      tracemalloc.stop()
+
+
+  def test_memory_does_not_grow_with_the_export(self):
+    self.seed(5_000)
+    small = {output:self.export(output) for output in ("ndjson","csv")}
+    self.seed(20_000)
+    large = {output:self.export(output) for output in ("ndjson","csv")}
+
+    for output in ("ndjson","csv"):
+      with self.subTest(output=output):
+        (small_peak, _, _), (large_peak, streamed, lines) = small[output], large[output]
+
+        self.assertEqual(lines, 25_000 + (output == "csv"))
+        self.assertLess(large_peak, small_peak * 1.5, "five times the rows, about the same peak")
+        self.assertLess(large_peak, streamed / 4, f"peak {large_peak} bytes for a {streamed} byte export")
+
+
+class ResponseCacheTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user   = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+    TaskModel.objects.create(owner=self.user, title="first")
+
+
+  @override_settings(TASK_CACHE_TIMEOUT=300)
+  def test_writes_invalidate_the_cached_list(self):
+    self.assertEqual(self.client.get('/api/tasks/list/')['X-Cache'], "MISS")
+    self.assertEqual(self.client.get('/api/tasks/list/')['X-Cache'], "HIT")
+
+    with self.captureOnCommitCallbacks(execute=True):   # versions are bumped on commit
+      TaskModel.objects.create(owner=self.user, title="second")
+    response = self.client.get('/api/tasks/list/')
+    self.assertEqual((response['X-Cache'], response.data['count']), ("MISS", 2))
+
+
+  @override_settings(TASK_CACHE_TIMEOUT=0)
+  def test_off_without_a_timeout(self):
+    for _ in range(2):
+      response = self.client.get('/api/tasks/list/')
+      self.assertFalse(response.has_header('X-Cache'))
+
+
+  @override_settings(AUTH_USER_STATE_TIMEOUT=0, TASK_CACHE_TIMEOUT=300, CACHES={'default':{'BACKEND':'django.core.cache.backends.locmem.LocMemCache'}})
+  def test_the_response_cache_refuses_local_memory(self):
+    self.assertEqual([error.msg for error in check_shared_cache(None)], ["TASK_CACHE_TIMEOUT needs a cache shared between processes"])
+
+    with self.settings(CACHES={'default':{'BACKEND':'django.core.cache.backends.redis.RedisCache', 'LOCATION':"redis://127.0.0.1:6379/0"}}):
+      self.assertEqual(check_shared_cache(None), [])
+
+
+
+class ConditionalListTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user   = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+    self.tasks  = [TaskModel.objects.create(owner=self.user, title=f"task {number}") for number in range(2)]
+
+
+  def test_a_delete_changes_the_list_validators(self):
+    first = self.client.get('/api/tasks/list/')
+    self.assertFalse(first.has_header('Last-Modified'))   # deletes don't move the latest updated_at
+    self.assertEqual(self.client.get('/api/tasks/list/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    with self.captureOnCommitCallbacks(execute=True):   # for the response cache, when it's on
+      self.tasks[0].delete()
+    response = self.client.get('/api/tasks/list/', HTTP_IF_NONE_MATCH=first['ETag'],
+                               HTTP_IF_MODIFIED_SINCE=self.client.get(f'/api/tasks/retrieve/{self.tasks[1].id}/')['Last-Modified'])
+    self.assertEqual((response.status_code, response.data['count']), (200, 1))
+
+
+
+class SyncFeedTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+
+
+  def sync(self, cursor=None):
+    return self.client.get('/api/tasks/sync/', {"since":cursor} if cursor else {})
+
+
+  def test_task_and_change_commit_together(self):
+    with mock.patch.object(TaskChange.objects, 'bulk_create', side_effect=DatabaseError):
+      with self.assertRaises(DatabaseError), transaction.atomic():
+        TaskModel.objects.create(owner=self.user, title="lost")
+
+    self.assertFalse(TaskModel.objects.exists())
+
+
+  def test_deleting_a_user_logs_their_tasks_as_deleted(self):
+    task = TaskModel.objects.create(owner=self.user, title="first")
+    self.user.delete()
+
+    self.assertEqual(list(TaskChange.objects.filter(task_id=task.id).order_by('id').values_list('action', flat=True)),
+                     ['created','deleted'])
+
+
+  def test_cursor_continues_after_the_last_change(self):
+    TaskModel.objects.create(owner=self.user, title="first")
+    cursor = self.sync().data['cursor']
+    second = TaskModel.objects.create(owner=self.user, title="second")
+
+    response = self.sync(cursor)
+    self.assertEqual([task['id'] for task in response.data['updated']], [second.id])
+    self.assertEqual(self.sync(response.data['cursor']).data['updated'], [])
+
+
+  def test_expired_and_invalid_cursors(self):
+    cursor = self.sync().data['cursor']
+
+    with mock.patch('api.sync.time.time', return_value=time.time() + 31 * 86400):
+      self.assertEqual(self.sync(cursor).status_code, 410)
+    self.assertEqual(self.sync("not-a-cursor").status_code, 400)
+
+
+  def test_prune_keeps_the_latest_change_of_live_tasks(self):
+    kept    = TaskModel.objects.create(owner=self.user, title="kept")
+    deleted = TaskModel.objects.create(owner=self.user, title="deleted")
+    kept.title = "renamed"
+    kept.save()
+    deleted.delete()
+    TaskChange.objects.update(changed_at=timezone.now() - timedelta(days=40))
+
+    self.assertEqual(prune_changes(batch_size=1), 3)   # kept's created row, deleted's created row and its tombstone
+    response = self.sync()
+    self.assertEqual([task['title'] for task in response.data['updated']], ["renamed"])
+    self.assertEqual(response.data['deleted'], [])
+
+
+
+@override_settings(TASK_STATS_SUMMARY=True)
+class StatsSummaryTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user  = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.staff = User.objects.create_user(username="admin", email="admin@example.com", password="password-123", is_staff=True)
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+
+
+  def summary(self):
+    return sorted(TaskSummary.objects.filter(count__gt=0).values_list('owner_id','status','due_date','count'))
+
+
+  def test_writes_keep_the_summary_equal_to_a_rebuild(self):
+    self.client.post('/api/tasks/create/', {"title":"first"}, format='json')
+    self.client.post('/api/tasks/bulk/create/', [{"title":"second"}, {"title":"third", "status":True}], format='json')
+    first, second, third = TaskModel.objects.order_by('id')
+
+    self.client.put(f'/api/tasks/update/{first.id}/', {"status":True}, format='json')
+    self.client.put('/api/tasks/bulk/update/', [{"id":third.id, "status":False}], format='json')
+    self.client.delete(f'/api/tasks/delete/{second.id}/')
+
+    staff = APIClient()
+    staff.force_authenticate(self.staff)
+    staff.put(f'/api/tasks/update/{third.id}/', {"owner":self.staff.id}, format='json')
+
+    maintained = self.summary()
+    rebuild_summary()
+    self.assertEqual(maintained, self.summary())
+    self.assertEqual(self.client.get('/api/tasks/stats/').data['totals']['completed'], 1)
+
+
+  def test_a_write_touches_only_its_buckets(self):
+    task = TaskModel.objects.create(owner=self.user, title="first")
+    for number in range(20):
+      TaskModel.objects.create(owner=self.user, title=f"other {number}", status=number % 2 == 0)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.client.put(f'/api/tasks/update/{task.id}/', {"status":True}, format='json')
+
+    summary_queries = [query['sql'] for query in queries.captured_queries if 'api_tasksummary' in query['sql']]
+    self.assertEqual(len(summary_queries), 2)   # -1 on the old bucket and +1 on the new one, no recount
+    self.assertTrue(all(query.startswith('UPDATE') for query in summary_queries))
+
+
+  def test_staff_stats_page_over_owners(self):
+    for user in (self.user, self.staff):
+      TaskModel.objects.create(owner=user, title="first")
+    other = User.objects.create_user(username="bob", email="bob@example.com", password="password-123")
+    TaskModel.objects.create(owner=other, title="first", status=True)
+    rebuild_summary()
+
+    staff = APIClient()
+    staff.force_authenticate(self.staff)
+
+    with self.assertNumQueries(2):   # the totals, a page of owners
+      first = staff.get('/api/tasks/stats/', {"page_size":2}).data
+    last = staff.get(first['next']).data
+
+    self.assertEqual([row['owner'] for row in first['owners'] + last['owners']], [self.user.id, self.staff.id, other.id])
+    self.assertIsNone(last['next'])
+    self.assertEqual(first['totals'], last['totals'])
+    self.assertEqual((first['totals']['total'], first['totals']['completed']), (3, 1))
+    self.assertEqual(staff.get('/api/tasks/stats/', {"after":"x"}).status_code, 400)
+
+
+
+def throttle_rates(**rates):
+  return override_settings(THROTTLING_ENABLED=True,
+                           REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                           'DEFAULT_THROTTLE_RATES':{**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **rates}})
+
+
+
+@mock.patch('api.throttling.time.time', return_value=1_000_000_020.0)   # the start of a minute, no previous window to weigh in
+class ThrottleTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.users = [User.objects.create_user(username=name, email=f"{name}@example.com", password="password-123") for name in ("alice","bob")]
+    self.clients = []
+    for user in self.users:
+      client = APIClient()
+      client.force_authenticate(user)
+      self.clients.append(client)
+    self.token = TaskRefreshToken.for_user(self.users[0]).access_token
+
+
+  @throttle_rates(ip="15/min", user="10/min")
+  def test_a_refused_request_charges_no_scope(self, _):
+    alice, bob = self.clients
+    self.assertEqual(alice.get('/api/tasks/stats/').status_code, 200)   # stats cost 5 per request
+    self.assertEqual(alice.get('/api/tasks/stats/').status_code, 200)
+
+    refused = alice.get('/api/tasks/stats/')   # over alice's user budget, the ip budget gets its 5 back
+    self.assertEqual(refused.status_code, 429)
+    self.assertIn('Retry-After', refused)
+
+    self.assertEqual(bob.get('/api/tasks/stats/').status_code, 200)   # same address, 15 of 15 spent
+    self.assertEqual(bob.get('/api/tasks/stats/').status_code, 429)
+
+
+  @throttle_rates(user="2/min")
+  async def test_async_views_spend_the_same_budget(self, _):
+    headers = {"Authorization":f"Bearer {self.token}"}
+    for _ in range(2):
+      self.assertEqual((await self.async_client.get('/api/async/tasks/list/', headers=headers)).status_code, 200)
+
+    refused = await self.async_client.get('/api/async/tasks/list/', headers=headers)
+    self.assertEqual(refused.status_code, 429)
+    self.assertIn('Retry-After', refused)
+
+
+  @throttle_rates(ip="2/min")
+  def test_a_forged_forwarded_for_keeps_the_address_budget(self, _):
+    alice, bob = self.clients
+
+    # as configured (no proxy), then behind one proxy, where the entry it appended counts
+    for num_proxies, proxy in ((settings.REST_FRAMEWORK['NUM_PROXIES'], ""), (1, ", 10.0.0.9")):
+      with self.subTest(num_proxies=num_proxies), self.settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES':num_proxies}):
+        cache.clear()
+        statuses = [client.get('/api/tasks/list/', HTTP_X_FORWARDED_FOR=f"203.0.113.{number}{proxy}").status_code
+                    for number, client in enumerate((alice, bob, alice))]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+
+class TokenBlacklistTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.refresh = self.client.post('/api/auth/login/', {"username":"alice", "password":"password-123"}, format='json').data['refresh']
+
+
+  def refresh_status(self):
+    return self.client.post('/api/auth/refresh/', {"refresh":self.refresh}, format='json').status_code
+
+
+  def test_a_logout_elsewhere_is_seen_right_away(self):
+    self.assertEqual(self.refresh_status(), 200)
+
+    # blacklisted by another worker, whose cache this process never sees
+    BlacklistedToken.objects.bulk_create([BlacklistedToken(token=OutstandingToken.objects.get())])
+    self.assertEqual(self.refresh_status(), 400)
+
+
+  def test_blacklisted_tokens_are_cached(self):
+    self.client.post('/api/auth/logout/', {"refresh":self.refresh}, format='json')
+
+    with self.assertNumQueries(0):
+      self.assertEqual(self.refresh_status(), 400)
+
+
+  @mock.patch('api.tokens.shared_cache', return_value=True)
+  def test_valid_tokens_are_cached_on_a_shared_cache(self, _):
+    self.assertEqual(self.refresh_status(), 200)
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.refresh_status(), 200)
+    self.assertFalse([query for query in queries.captured_queries if 'blacklistedtoken' in query['sql']])
+
+    self.client.post('/api/auth/logout/', {"refresh":self.refresh}, format='json')   # overwrites the cached answer
+    self.assertEqual(self.refresh_status(), 400)
+
+
+
+class UserStateTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user   = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.client = APIClient()
+    self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {TaskRefreshToken.for_user(self.user).access_token}")
+
+
+  @override_settings(AUTH_USER_STATE_TIMEOUT=60, TASK_CACHE_TIMEOUT=0, CACHES={'default':{'BACKEND':'django.core.cache.backends.locmem.LocMemCache'}})
+  def test_the_state_cache_refuses_local_memory(self):
+    self.assertEqual([error.id for error in check_shared_cache(None)], ['api.E001'])
+
+    with self.settings(AUTH_USER_STATE_TIMEOUT=0):
+      self.assertEqual(check_shared_cache(None), [])
+
+
+  @override_settings(AUTH_USER_STATE_TIMEOUT=0)
+  def test_without_the_cache_a_deactivation_applies_at_once(self):
+    self.assertEqual(self.client.get('/api/tasks/list/').status_code, 200)
+
+    User.objects.filter(id=self.user.id).update(is_active=False)   # no signal, as if saved by another worker
+    self.assertEqual(self.client.get('/api/tasks/list/').status_code, 401)
+
+
+
+class MetricsTests(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.user  = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    self.staff = User.objects.create_user(username="admin", email="admin@example.com", password="password-123", is_staff=True)
+    self.token = TaskRefreshToken.for_user(self.user).access_token
+
+
+  @override_settings(METRICS_TOKEN=None)
+  def test_without_a_token_only_staff_get_the_metrics(self):
+    self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    self.client.force_login(self.user)
+    self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    self.client.force_login(self.staff)
+    self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+
+  @override_settings(METRICS_TOKEN="s3cret")
+  def test_a_token_is_required_when_set(self):
+    self.client.force_login(self.staff)
+    self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+    self.assertEqual(self.client.get('/api/metrics/', headers={"Authorization":"Bearer s3cret"}).status_code, 200)
+
+
+  def test_queries_are_timed_only_during_requests(self):
+    client = APIClient()
+    client.force_authenticate(self.user)
+
+    response = client.get('/api/tasks/stats/')
+    self.assertIn('desc="', response['Server-Timing'])
+    self.assertNotIn(measure_query, connection.execute_wrappers)
+
+
+  async def test_async_views_count_their_queries(self):
+    response = await self.async_client.get('/api/async/tasks/list/', headers={"Authorization":f"Bearer {self.token}"})
+
+    self.assertEqual(response.status_code, 200)
+    self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+
+
+
+@override_settings(TASK_STATS_SUMMARY=True)
+class ImportTasksTests(TestCase):
+
+  def setUp(self):
+    self.user = User.objects.create_user(username="alice", email="alice@example.com", password="password-123")
+    TaskModel.objects.create(owner=self.user, title="taken")
+
+
+  def import_rows(self, *rows, batch_size=5000):
+    with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as source, tempfile.NamedTemporaryFile('r', suffix='.ndjson') as rejects:
+      source.write("".join(f"{json.dumps(row)}\n" for row in rows))
+      source.flush()
+      call_command('import_tasks', source.name, owner=self.user.id, batch_size=batch_size, rejects=rejects.name, stdout=StringIO())
+      return [(reject['line'], reject['errors']) for reject in map(json.loads, rejects)]
+
+
+  def test_taken_titles_are_rejected_with_their_line(self):
+    rejects = self.import_rows({"title":"new"}, {"title":"taken"}, {"title":"new"}, {"title":"other", "owner":999}, {"title":"last", "status":True},
+                               batch_size=3)
+
+    taken = {"title":"A task with the same title already exists"}
+    self.assertEqual(sorted(rejects), [(2, taken), (3, taken), (4, {"owner":"User with this ID does not exist"})])
+    self.assertEqual(sorted(TaskModel.objects.values_list('title', flat=True)), ["last","new","taken"])
+
+    self.assertEqual(TaskChange.objects.count(), 3)
+    self.assertEqual(sorted(TaskSummary.objects.values_list('status','count')), [(False,2), (True,1)])
+
+
+  def test_a_batch_is_one_insert(self):
+    with CaptureQueriesContext(connection) as queries:
+      self.import_rows({"title":"one"}, {"title":"two"}, {"title":"taken"})
+
+    task_queries = [query['sql'] for query in queries.captured_queries if 'api_taskmodel' in query['sql']]
+    self.assertEqual(len(task_queries), 1)
+    self.assertTrue(task_queries[0].startswith('INSERT'))
+
+
+
+class ReplicaPinCheckTests(TestCase):
+
+  @override_settings(AUTH_USER_STATE_TIMEOUT=0, TASK_CACHE_TIMEOUT=0, DATABASE_REPLICAS=['replica_1'],
+                     CACHES={'default':{'BACKEND':'django.core.cache.backends.locmem.LocMemCache'}})
+  def test_replicas_refuse_local_memory(self):
+    # a write in one process pins the user there only, the next request may read a lagging replica
+    self.assertEqual([error.msg for error in check_shared_cache(None)], ["DATABASE_REPLICAS needs a cache shared between processes"])
+
+    with self.settings(DATABASE_REPLICAS=[]):
+      self.assertEqual(check_shared_cache(None), [])
+
+
+
+REPLICA_CONFIGURED = 'replica_1' in settings.DATABASES
+
+
+@skipUnless(REPLICA_CONFIGURED, "set DATABASE_REPLICA_HOSTS to test the replica routing")
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRoutingTests(TestCase):
+  databases = {'default', 'replica_1'} if REPLICA_CONFIGURED else {'default'}   # the runner sets them up even when skipped
+
+  def setUp(self):
+    cache.clear()
+    self.alice, self.bob = [User.objects.create_user(username=name, email=f"{name}@example.com", password="password-123") for name in ("alice","bob")]
+
+
+  def client_for(self, user):   # a fresh token each time, as a second device would have
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {TaskRefreshToken.for_user(user).access_token}")
+    return client
+
+
+  def task_queries(self, request):
+    # the kinds of statements the request ran on the task table, on the primary and on the replica
+    with CaptureQueriesContext(connections['default']) as primary, CaptureQueriesContext(connections['replica_1']) as replica:
+      request()
+    return [{query['sql'].split()[0] for query in captured if 'api_taskmodel' in query['sql']} for captured in (primary, replica)]
+
+
+  def test_reads_go_to_the_replica(self):
+    client = self.client_for(self.alice)
+    self.assertEqual(self.task_queries(lambda: client.get('/api/tasks/list/')), [set(), {'SELECT'}])
+
+    with transaction.atomic():   # unless they are part of a transaction
+      self.assertEqual(self.task_queries(lambda: client.get('/api/tasks/list/?status=true')), [{'SELECT'}, set()])
+
+
+  def test_writes_go_to_the_primary_and_pin_the_user(self):
+    alice = self.client_for(self.alice)
+    primary, _ = self.task_queries(lambda: alice.post('/api/tasks/create/', {"title":"first"}, format='json'))
+    self.assertEqual(primary, {'INSERT'})
+
+    other_device = self.client_for(self.alice)
+    self.assertEqual(self.task_queries(lambda: other_device.get('/api/tasks/list/')), [{'SELECT'}, set()])
+
+    bob = self.client_for(self.bob)
+    self.assertEqual(self.task_queries(lambda: bob.get('/api/tasks/list/')), [set(), {'SELECT'}])
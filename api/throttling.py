@@ -0,0 +1,149 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+# sliding window throttles on the cache backend.
+#
+# a rate like "100/min" is a budget of 100 tokens per minute. every request spends
+# view.throttle_cost tokens (1 unless the view says otherwise), so expensive endpoints
+# use the budget up faster. the window is approximated from two fixed windows, the
+# current one weighted fully and the previous one by how much of it still overlaps, which
+# needs one read and one atomic increment per request and no per request history.
+#
+# DRF checks throttles before the view runs, so a rejected request never reaches a
+# password hasher or a query. it asks every throttle in turn, so the scopes settle the
+# request between them: each one records what it charged on the request, one that turns
+# the request away hands back everything charged before it, and the scopes after it only
+# look without charging. a refused request costs no scope anything
+
+
+class CostThrottle(BaseThrottle):
+
+  scope = None
+
+  def get_scope(self, view):
+    return self.scope
+
+
+  def get_key(self, request, view):   # None skips the throttle
+    raise NotImplementedError
+
+
+  def allow_request(self, request, view):
+    scope = self.get_scope(view)
+    rate  = api_settings.DEFAULT_THROTTLE_RATES.get(scope) if scope else None
+    if not settings.THROTTLING_ENABLED or rate is None:
+      return True
+
+    key = self.get_key(request, view)
+    if key is None:
+      return True
+
+    limit, period = self.parse_rate(rate)
+    cost = getattr(view, 'throttle_cost', 1)
+
+    now    = time.time()
+    window = int(now // period)
+    current_key  = f"throttle:{scope}:{key}:{window}"
+    previous_key = f"throttle:{scope}:{key}:{window - 1}"
+
+    refused  = getattr(request, '_throttle_refused', False)
+    previous = cache.get(previous_key, 0)
+    current  = cache.get(current_key, 0) + cost if refused else self.spend(current_key, cost, period)
+
+    overlap = 1 - (now % period) / period
+    if previous * overlap + current <= limit:
+      if not refused:
+        charges = getattr(request, '_throttle_charges', [])
+        request._throttle_charges = [*charges, (current_key, cost, period)]
+      return True
+
+    if not refused:
+      for charged_key, charged, charged_period in [*getattr(request, '_throttle_charges', []), (current_key, cost, period)]:
+        self.spend(charged_key, -charged, charged_period)   # a turned away request doesn't use up any budget
+      request._throttle_charges = []
+      request._throttle_refused = True
+
+    self.retry_after = self.wait_time(previous, current, limit, period, now)
+    return False
+
+
+  def spend(self, key, tokens, period):
+    if tokens > 0 and cache.add(key, tokens, timeout=period * 2):
+      return tokens
+    try:
+      return cache.incr(key, tokens)
+    except ValueError:   # expired in between
+      cache.set(key, max(tokens, 0), timeout=period * 2)
+      return max(tokens, 0)
+
+
+  def wait_time(self, previous, current, limit, period, now):
+    # seconds until the previous window's share has shrunk enough for this request, or until this window is over
+    elapsed = now % period
+    if previous and current <= limit:
+      overlap_needed = (limit - current) / previous
+      return max(1, math.ceil((1 - overlap_needed) * period - elapsed))
+    return max(1, math.ceil(period - elapsed))
+
+
+  def parse_rate(self, rate):   # "100/min" -> (100, 60), same format as DRF's rates
+    tokens, period = rate.split('/')
+    return int(tokens), {'s':1, 'm':60, 'h':3600, 'd':86400}[period[0]]
+
+
+  def wait(self):
+    return getattr(self, 'retry_after', None)
+
+
+
+def throttle_wait(request, view):
+  # DRF's throttle check for views outside DRF (the async task views): None when the request may
+  # go ahead, otherwise the seconds to wait
+  waits = [throttle.wait() for throttle in (throttle_class() for throttle_class in view.throttle_classes)
+           if not throttle.allow_request(request, view)]
+  return max(waits) if waits else None
+
+
+
+class IPRateThrottle(CostThrottle):   # every request, per client address
+  scope = 'ip'
+
+  def get_key(self, request, view):
+    return self.get_ident(request)
+
+
+
+class UserRateThrottle(CostThrottle):   # authenticated requests, per user across all endpoints
+  scope = 'user'
+
+  def get_key(self, request, view):   # authentication has already run when throttles are checked
+    return request.user.id if request.user.is_authenticated else None
+
+
+
+class EndpointRateThrottle(CostThrottle):   # views with a throttle_scope, per user or per address
+  def get_scope(self, view):
+    return getattr(view, 'throttle_scope', None)
+
+  def get_key(self, request, view):
+    if request.user.is_authenticated:
+      return f"user:{request.user.id}"
+    return f"ip:{self.get_ident(request)}"
+
+
+
+class LoginUsernameThrottle(CostThrottle):
+  # attempts against one account from any number of addresses, read from the body before any hashing
+  scope = 'login_username'
+
+  def get_key(self, request, view):
+    username = request.data.get('username') if hasattr(request.data, 'get') else None
+    if not isinstance(username, str) or not username:
+      return None
+    return username.lower()
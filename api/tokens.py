@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken, TokenError
+
+from api.caching import shared_cache
+
+
+def _blacklist_key(jti):
+  return f"auth:blacklisted:{jti}"
+
+
+
+def _seconds_left(exp):
+  return max(1, int(exp - timezone.now().timestamp()))
+
+
+
+class TaskRefreshToken(RefreshToken):
+  # refresh token carrying the account flags the API authorizes on. access tokens
+  # created from it copy them, so requests can be authorized without loading the user
+
+  @classmethod
+  def for_user(cls, user):
+    token = super().for_user(user)
+
+    token['is_staff']  = user.is_staff
+    token['is_active'] = user.is_active
+    return token
+
+
+  def check_blacklist(self):
+    # the answer is cached until the token expires. "blacklisted" always is, a token never comes
+    # off the blacklist. "not blacklisted" only on a shared cache, where blacklisting the token
+    # overwrites it for every process; in local memory it would let a logged out token through
+    # in the other processes, so without one those always come from the database
+    jti         = self.payload[api_settings.JTI_CLAIM]
+    blacklisted = cache.get(_blacklist_key(jti))
+
+    if blacklisted is None:
+      blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+      if blacklisted:
+        cache.set(_blacklist_key(jti), True, _seconds_left(self.payload['exp']))
+      elif shared_cache():
+        cache.add(_blacklist_key(jti), False, _seconds_left(self.payload['exp']))   # add, a blacklisting in between wins
+
+    if blacklisted:
+      raise TokenError("Token is blacklisted")
+
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def cache_blacklisted_token(sender, instance, **kwargs):
+  # covers logout, rotation and the admin alike, the process doing it skips the database from then on
+  token = instance.token
+  cache.set(_blacklist_key(token.jti), True, _seconds_left(token.expires_at.timestamp()))
@@ -1,5 +1,7 @@
 from django.urls import path, include
 from api import views
+from api import async_views
+from api.metrics import metrics_view
 
 urlpatterns = [
     # auth urls
@@ -12,10 +14,28 @@ urlpatterns = [
     # crud urls
     path('tasks/create/',        views.CreateTaskAPIView.as_view(),   name="create_task"), # create a task
     path('tasks/list/',          views.ListTaskAPIView.as_view(),     name="list_tasks"),  # list all tasks
+    path('tasks/export/',        views.ExportTaskAPIView.as_view(),   name="export_tasks"), # stream all tasks as ndjson/csv
+    path('tasks/sync/',          views.SyncTaskAPIView.as_view(),     name="sync_tasks"),  # changes since a cursor
+    path('tasks/stats/',         views.StatsTaskAPIView.as_view(),    name="task_stats"),  # dashboard counts
     path('tasks/retrieve/<id>/', views.RetrieveTaskAPIView.as_view(), name="get_task"),    # retrieve a task
     path('tasks/update/<id>/',   views.UpdateTaskAPIView.as_view(),   name="update_task"), # update a task
     path('tasks/delete/<id>/',   views.DeleteTaskAPIView.as_view(),   name="delete_task"), # delete a task
 
+    # async crud urls, for ASGI deployments
+    path('async/tasks/create/',        async_views.AsyncCreateTaskView.as_view(),   name="async_create_task"),
+    path('async/tasks/list/',          async_views.AsyncListTaskView.as_view(),     name="async_list_tasks"),
+    path('async/tasks/retrieve/<id>/', async_views.AsyncRetrieveTaskView.as_view(), name="async_get_task"),
+    path('async/tasks/update/<id>/',   async_views.AsyncUpdateTaskView.as_view(),   name="async_update_task"),
+    path('async/tasks/delete/<id>/',   async_views.AsyncDeleteTaskView.as_view(),   name="async_delete_task"),
+
+    # prometheus metrics
+    path('metrics/', metrics_view, name="metrics"),
+
+    # bulk urls
+    path('tasks/bulk/create/', views.BulkCreateTaskAPIView.as_view(), name="bulk_create_tasks"), # create many tasks
+    path('tasks/bulk/update/', views.BulkUpdateTaskAPIView.as_view(), name="bulk_update_tasks"), # update many tasks
+    path('tasks/bulk/delete/', views.BulkDeleteTaskAPIView.as_view(), name="bulk_delete_tasks"), # delete many tasks
+
 ]
 
 
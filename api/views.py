@@ -1,32 +1,147 @@
-from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework import serializers
-from .serializers import RegisterSerializer,LoginSerializer, TaskSerializer, LogoutSerializer
-from rest_framework_simplejwt.tokens import RefreshToken,TokenError
+from .serializers import RegisterSerializer,LoginSerializer, TaskSerializer, LogoutSerializer, TaskBulkSerializer, LeanTaskSerializer
+from rest_framework_simplejwt.tokens import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from api.tokens import TaskRefreshToken
+from api.authentication import get_user_state
 from django.contrib.auth import authenticate
 from rest_framework.permissions import IsAuthenticated
-from api.models import TaskModel
-from rest_framework.pagination import PageNumberPagination
+from api.models import TaskModel, default_due_date
+from api import bulk
+from api.filters import filter_tasks
+from api.caching import cache_task_response
+from api.conditional import conditional_response, list_summary, list_validators, page_summary, set_validators, task_validators
+from api.signals import tasks_changed, bucket_deltas, CREATED, UPDATED, DELETED
+from api.sync import CursorExpired, decode_cursor, read_changes
+from api.stats import task_stats
+from django.db import transaction, IntegrityError
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import Q
+from django.core.paginator import Paginator as DjangoPaginator
+from functools import partial
+from django.http import StreamingHttpResponse
+from django.conf import settings
+import csv
+import json
+from datetime import datetime
+import base64
 from django.utils import timezone
 from rest_framework.permissions import AllowAny
 from rest_framework.generics import GenericAPIView
+from api.throttling import LoginUsernameThrottle
+from api.hashers import password_slot
+from api.ownership import scoped_tasks, missing_task, update_task, delete_task
 
 
 # Create your views here.
 
 
+class KnownCountPaginator(DjangoPaginator):
+  # paginator for a queryset that was already counted, skips its own COUNT query
+
+  def __init__(self, object_list, per_page, known_count=None, **kwargs):
+    super().__init__(object_list, per_page, **kwargs)
+
+    if known_count is not None:
+      self.__dict__['count'] = known_count
+
+
+
 class TaskPagination(PageNumberPagination):
   page_size = 5
   page_size_query_param = "page_size"
   max_page_size = 50
 
+  def paginate_queryset(self, queryset, request, view=None, count=None):
+    self.django_paginator_class = partial(KnownCountPaginator, known_count=count)
+    return super().paginate_queryset(queryset, request, view)
+
+
+
+class TaskCursorPagination(BasePagination):
+  # keyset pagination on (created_at, id), newest first. no COUNT and no OFFSET,
+  # every page is a single range scan starting right after the previous page's last row
+
+  cursor_query_param = "cursor"
+  invalid_cursor_message = "Invalid cursor"
+
+
+  def paginate_queryset(self, queryset, request, view=None, count=None):
+    return self.set_page(list(self.page_queryset(queryset, request)))
+
+
+  async def apaginate_queryset(self, queryset, request, view=None):
+    return self.set_page([task async for task in self.page_queryset(queryset, request)])
+
+
+  def page_queryset(self, queryset, request):
+    self.request = request
+    self.page_size = self.get_page_size(request)
+
+    queryset = queryset.order_by('-created_at','-id')
+
+    position = self.decode_cursor(request)
+    if position is not None:
+      created_at, last_id = position
+      queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id))
+
+    return queryset[:self.page_size + 1]   # one extra row tells us whether a next page exists
+
+
+  def set_page(self, results):
+    self.has_next = len(results) > self.page_size
+    self.page = results[:self.page_size]
+
+    return self.page
+
+
+  def get_page_size(self, request):   # same page_size rules as the numbered pages
+    return TaskPagination().get_page_size(request)
+
+
+  def decode_cursor(self, request):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None
+
+    try:
+      decoded = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+      created_at, last_id = decoded.split('|')
+      return datetime.fromisoformat(created_at), int(last_id)
+    except (TypeError, ValueError, UnicodeError):
+      raise NotFound(self.invalid_cursor_message)
+
+
+  def encode_cursor(self, row):   # pages are values() rows
+    position = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+
+  def get_next_link(self):
+    if not self.has_next:
+      return None
+
+    url = self.request.build_absolute_uri()
+    return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+
+  def get_paginated_response(self, data):
+    return Response({'next':self.get_next_link(),
+                     'results':data
+                    })
+
 
 
 class RegisterAPIView(GenericAPIView):
 
   permission_classes = [AllowAny]
+  authentication_classes = []   # no token to check, and throttles run without a JWT decode
   serializer_class = RegisterSerializer
+  throttle_scope = 'auth'
+  throttle_cost  = 10   # hashes a password
 
   def post(self,request):
     serializer = self.serializer_class(data=request.data)
@@ -41,7 +156,11 @@ class RegisterAPIView(GenericAPIView):
 class LoginAPIView(GenericAPIView):
 
   permission_classes = [AllowAny]
+  authentication_classes = []
   serializer_class = LoginSerializer
+  throttle_classes = [*GenericAPIView.throttle_classes, LoginUsernameThrottle]
+  throttle_scope = 'auth'
+  throttle_cost  = 10   # hashes a password
 
   def post(self,request):
 
@@ -52,12 +171,13 @@ class LoginAPIView(GenericAPIView):
     username = serializer.validated_data.get('username')
     password = serializer.validated_data.get('password')
 
-    user = authenticate(username=username,password=password)
+    with password_slot():
+      user = authenticate(username=username,password=password)   # also upgrades an outdated hash
 
     if not user:  # user exists with given username and pw so authenticating 
       return Response({'detail':'Invalid credentials'},status=status.HTTP_401_UNAUTHORIZED)
 
-    refresh = RefreshToken.for_user(user)
+    refresh = TaskRefreshToken.for_user(user)   # carries is_staff/is_active, see api.authentication
 
     return Response({'refresh':str(refresh),
                      'access':str(refresh.access_token)
@@ -68,7 +188,9 @@ class LoginAPIView(GenericAPIView):
 
 class LogoutAPIView(GenericAPIView):
   permission_classes = [AllowAny]
+  authentication_classes = []
   serializer_class = LogoutSerializer
+  throttle_scope = 'auth'
 
   def post(self,request):
     serializer = self.serializer_class(data=request.data)
@@ -85,15 +207,23 @@ class LogoutAPIView(GenericAPIView):
 class RefreshTokenAPIView(GenericAPIView):
   
   permission_classes = [AllowAny]
+  authentication_classes = []
+  throttle_scope = 'auth'
 
   def post(self,request):
     refresh_token = request.data.get('refresh')
 
     try:
-      refresh = RefreshToken(refresh_token)   # validaiton of refresh token 
+      refresh = TaskRefreshToken(refresh_token)   # validaiton of refresh token 
 
       new_access = refresh.access_token      # creating a new access token from the refresh token
 
+      # flags come from the current account state, so tokens issued before they were claims
+      # pick them up and a change of staff status reaches the next access token
+      state = get_user_state(refresh[api_settings.USER_ID_CLAIM])
+      new_access['is_staff']  = state['is_staff']
+      new_access['is_active'] = state['is_active']
+
       return Response({'access':str(new_access)},status=status.HTTP_200_OK)
 
     except TokenError:
@@ -124,80 +254,168 @@ class ListTaskAPIView(GenericAPIView):
   pagination_class = TaskPagination
   serializer_class = TaskSerializer
 
+  @cache_task_response
   def get(self,request):
 
-    if request.user.is_staff:
-      # admin has logged in
-      tasks = TaskModel.objects.filter().all()
-    else:
-      #user has logged in
-      tasks = TaskModel.objects.filter(owner=request.user)
-
-    if not tasks.exists():
-      return Response({"message":"No tasks found",
-                       "data":[]},
-                       status=status.HTTP_200_OK
-                     )
-    
-    task_status = request.query_params.get('status')
-    if task_status is not None:
-      if task_status.lower() == "true":
-        tasks = tasks.filter(status=True)
+    tasks = filter_tasks(request)
 
-      elif task_status.lower() == "false":
-        tasks = tasks.filter(status=False)
+    # pages are fetched as values() rows of only the columns the response needs (fields=...),
+    # owner details for expand=owner come from the same query through a join
+    serializer = LeanTaskSerializer.from_request(request)
+    rows = serializer.rows(tasks)
 
 
-    owner = request.query_params.get('owner')
-    if owner is not None:
-      if request.user.is_staff:
-        tasks = tasks.filter(owner_id=owner)
-      else:
-        return Response({"message":"Request not allowed"}, status=status.HTTP_403_FORBIDDEN)
-      
+    if request.query_params.get('pagination') == 'cursor':
+      # the page is the only query, its rows give the validators
+      paginator = TaskCursorPagination()
+      page = paginator.paginate_queryset(rows, request)
+      summary = page_summary(page, paginator.has_next)
+    else:
+      # one aggregate gives the validators and stands in for the paginator's COUNT
+      paginator = self.pagination_class()
+      page = None
+      summary = list_summary(tasks)
 
-    due = request.query_params.get('due_date')
-    if due is not None:
-      date_field = serializers.DateField()
-   
-      due_date = date_field.to_internal_value(due)
-      try:
-        tasks = tasks.filter(due_date=due_date)
-      except serializers.ValidationError:
-        return Response({"due_date":"Invalid date format. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
-      
+    etag, last_modified = list_validators(request, summary)
 
-      
-    paginator = self.pagination_class()
-    page = paginator.paginate_queryset(tasks, request)
+    not_modified = conditional_response(request, etag, last_modified)   # answered before any task is serialized
+    if not_modified:
+      return not_modified
+
+    if not summary['count']:
+      return set_validators(Response({"message":"No tasks found",
+                                      "data":[]},
+                                      status=status.HTTP_200_OK
+                                    ), etag, last_modified)
 
     if page is None:
-      serializer = self.serializer_class(tasks, many=True)
-      return Response(serializer.data)
+      page = paginator.paginate_queryset(rows, request, count=summary['count'])
       
-    serializer = self.serializer_class(page, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    return set_validators(paginator.get_paginated_response(serializer.to_representation(page)), etag, last_modified)
   
 
 
+class EchoBuffer:
+  # csv.writer needs a file object, this one hands every written line straight back
+
+  def write(self, value):
+    return value
+
+
+
+class ExportTaskAPIView(GenericAPIView):
+
+  permission_classes = [IsAuthenticated]
+  export_fields = ['id','title','description','status','owner','due_date','created_at']
+  throttle_scope = 'export'
+  throttle_cost  = 20   # streams every task of the user
+
+  def perform_content_negotiation(self, request, force=False):
+    # the body is streamed as ndjson/csv rather than rendered, so an Accept of text/csv must not end in a 406
+    return super().perform_content_negotiation(request, force=True)
+
+  def get(self,request):
+    tasks = filter_tasks(request).order_by('id').values_list(*self.export_fields)
+    rows  = tasks.iterator(chunk_size=settings.TASK_EXPORT_CHUNK_SIZE)   # server side cursor, rows never pile up in memory
+
+    if request.query_params.get('output') == 'csv':
+      response = StreamingHttpResponse(self.csv_lines(rows), content_type='text/csv')
+      response['Content-Disposition'] = 'attachment; filename="tasks.csv"'
+    else:
+      response = StreamingHttpResponse(self.ndjson_lines(rows), content_type='application/x-ndjson')
+      response['Content-Disposition'] = 'attachment; filename="tasks.ndjson"'
+
+    return response
+
+
+  def export_row(self, row):
+    row = dict(zip(self.export_fields, row))
+    row['due_date'] = row['due_date'].isoformat() if row['due_date'] else None
+    row['created_at'] = row['created_at'].isoformat().replace('+00:00', 'Z')
+    return row
+
+
+  def ndjson_lines(self, rows):
+    for row in rows:
+      yield json.dumps(self.export_row(row)) + "\n"
+
+
+  def csv_lines(self, rows):
+    writer = csv.DictWriter(EchoBuffer(), fieldnames=self.export_fields)
+
+    yield writer.writeheader()
+    for row in rows:
+      yield writer.writerow(self.export_row(row))
+
+
+
+class SyncTaskAPIView(GenericAPIView):
+
+  permission_classes = [IsAuthenticated]
+  serializer_class = TaskBulkSerializer
+
+  def get(self,request):
+    try:
+      position = decode_cursor(request.query_params.get('since'))
+    except CursorExpired:   # the changes after it may be pruned already
+      return Response({"message":"Cursor expired, sync again from the start"}, status=status.HTTP_410_GONE)
+    except ValueError:
+      return Response({"message":"Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+      limit = int(request.query_params.get('limit', settings.TASK_SYNC_MAX_CHANGES))
+    except ValueError:
+      return Response({"message":"limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    limit = max(1, min(limit, settings.TASK_SYNC_MAX_CHANGES))
+    feed  = read_changes(request, position, limit)
+
+    changed = [task_id for task_id, action in feed['latest'].items() if action != DELETED]
+    tasks   = list(TaskModel.objects.visible_to(request.user).filter(id__in=changed))
+
+    # a task changed in this batch may be gone by now, its delete shows up in a later batch anyway
+    present = {task.id for task in tasks}
+    deleted = [task_id for task_id, action in feed['latest'].items() if action == DELETED or task_id not in present]
+
+    return Response({"cursor":feed['cursor'],
+                     "has_more":feed['has_more'],
+                     "updated":self.serializer_class(tasks, many=True).data,
+                     "deleted":deleted
+                    }, status=status.HTTP_200_OK
+                   )
+
+
+
+class StatsTaskAPIView(GenericAPIView):
+
+  permission_classes = [IsAuthenticated]
+  throttle_cost = 5   # aggregates over all of the user's tasks
+
+  def get(self,request):
+    return Response(task_stats(request), status=status.HTTP_200_OK)
+
+
+
 class RetrieveTaskAPIView(GenericAPIView):
 
   permission_classes = [IsAuthenticated]
   serializer_class = TaskSerializer
 
+  @cache_task_response
   def get(self,request,id):
-    task = TaskModel.objects.filter(id=id).first()
+    task = scoped_tasks(request.user, id).first()   # WHERE id AND owner_id, one query for the check and the read
     if not task:
-      return Response({"message":"Task not found"},status=status.HTTP_404_NOT_FOUND)
-    
-    if not request.user.is_staff:
-    
-      if task.owner_id != request.user.id:
-        return Response({"message":"Illegal access"},status=status.HTTP_403_FORBIDDEN)
+      code, body = missing_task(request.user, id)
+      return Response(body, status=code)
       
+    etag, last_modified = task_validators(task)
+
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified:
+      return not_modified
     
     serializer = self.serializer_class(task)
-    return Response(serializer.data,status=status.HTTP_200_OK)
+    return set_validators(Response(serializer.data,status=status.HTTP_200_OK), etag, last_modified)
 
 
 
@@ -208,22 +426,58 @@ class UpdateTaskAPIView(GenericAPIView):
 
   def put(self,request,id):
     data = request.data.copy()
-    task = TaskModel.objects.filter(id=id).first()
 
-    if not task:
+    conditional = 'If-Match' in request.headers or 'If-Unmodified-Since' in request.headers
+    if conditional or (request.user.is_staff and 'owner' in data):
+      with transaction.atomic():
+        return self.update_loaded(request, id, data, conditional)
+
+    # everything else is one UPDATE ... WHERE id AND owner_id RETURNING, validated against a stand in
+    # that only carries the id. a taken title is caught by the UPDATE itself, no query checks it up front
+    task_id = bulk.parse_id(id)
+    if task_id is None:
       return Response({"message":"Task not found"},status=status.HTTP_404_NOT_FOUND)
-    
 
-    if not request.user.is_staff:
+    serializer = self.serializer_class(TaskModel(id=task_id), data=data, partial=True,
+                                       context={"request":request, "title_checked_on_write":True})
+    if not serializer.is_valid():
+      if not scoped_tasks(request.user, id).exists():   # someone else's task is still a 403 (or 404), whatever the body
+        code, body = missing_task(request.user, id)
+        return Response(body, status=code)
+      return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+      task = update_task(request.user, id, serializer.validated_data)
+    except IntegrityError:   # unique_task_per_user, the only constraint an update without a new owner can break
+      return Response({"title":["A task with the same title already exists"]}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not task:
+      code, body = missing_task(request.user, id)
+      return Response(body, status=code)
+
+    return set_validators(Response(self.serializer_class(task).data, status=status.HTTP_200_OK), *task_validators(task))
+
+
+  def update_loaded(self, request, id, data, conditional):
+    # preconditions need the current row and a change of owner the previous one, so these load the task first
+    tasks = scoped_tasks(request.user, id)
+    if conditional:
+      tasks = tasks.select_for_update()   # nobody else can write the task between the check and the save
+
+    task = tasks.first()
 
-      if task.owner_id != request.user.id:
-        return Response({"message":"Illegal access"},status=status.HTTP_403_FORBIDDEN)
+    if not task:
+      code, body = missing_task(request.user, id)
+      return Response(body, status=code)
     
+    precondition_failed = conditional_response(request, *task_validators(task))
+    if precondition_failed:
+      return precondition_failed
 
     serializer = self.serializer_class(task, data=data, partial=True, context={"request":request})
     if serializer.is_valid():
       serializer.save()
-      return  Response(serializer.data, status=status.HTTP_200_OK)
+      return set_validators(Response(serializer.data, status=status.HTTP_200_OK), *task_validators(task))
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST) 
 
@@ -238,19 +492,248 @@ class DeleteTaskAPIView(GenericAPIView):
   serializer_class = TaskSerializer
 
   def delete(self,request,id):
-    task = TaskModel.objects.filter(id=id).first()
-
-    if not task:
-      return Response({"message":"Task not found"},status=status.HTTP_404_NOT_FOUND)
-    
-    if not request.user.is_staff:
+    if delete_task(request.user, id) is None:   # DELETE ... WHERE id AND owner_id RETURNING owner_id
+      code, body = missing_task(request.user, id)
+      return Response(body, status=code)
 
-      if task.owner_id != request.user.id:
-        return Response({"message":"Illegal access"},status=status.HTTP_403_FORBIDDEN)
-    
-    
-    task.delete()
     return Response(status=status.HTTP_204_NO_CONTENT)
-    
-  
 
+
+
+
+
+
+class BulkCreateTaskAPIView(GenericAPIView):
+
+  permission_classes = [IsAuthenticated]
+  serializer_class = TaskBulkSerializer
+  throttle_scope = 'bulk'
+  throttle_cost  = 10   # up to TASK_BULK_MAX_ITEMS rows
+
+  def post(self,request):
+    items = request.data
+    try:
+      bulk.check_batch_size(items)
+    except bulk.BulkRequestError as e:
+      return Response({"message":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    errors = {}
+    valid  = []
+
+    for index, item in enumerate(items):
+      serializer = self.serializer_class(data=item, context={'request':request})
+      if not serializer.is_valid():
+        errors[index] = serializer.errors
+        continue
+
+      valid.append((index, serializer.validated_data, bulk.requested_owner_id(request, item)))
+
+
+    owner_ids = bulk.existing_owner_ids(owner_id for index, data, owner_id in valid if owner_id != request.user.id)
+    owner_ids.add(request.user.id)
+
+    taken = bulk.existing_titles((owner_id, data['title']) for index, data, owner_id in valid if owner_id in owner_ids)
+
+    tasks = []
+    seen  = set()
+    for index, data, owner_id in valid:
+      if owner_id not in owner_ids:
+        errors[index] = {"owner":"User with this ID does not exist"}
+        continue
+
+      key = (owner_id, data['title'])
+      if key in taken or key in seen:   # duplicates against the database and within the batch itself
+        errors[index] = {"title":"A task with the same title already exists"}
+        continue
+      seen.add(key)
+
+      task = TaskModel(owner_id=owner_id, **data)
+      if not task.due_date:   # bulk_create skips TaskModel.save
+        task.due_date = default_due_date()
+      tasks.append(task)
+
+
+    if tasks:
+      try:
+        with transaction.atomic():
+          TaskModel.objects.bulk_create(tasks)
+          tasks_changed.send(sender=TaskModel, changes=[(CREATED, task.id, task.owner_id) for task in tasks],
+                             buckets=[(*task.counted_bucket(), 1) for task in tasks])
+      except IntegrityError:
+        return Response({"detail":"A task with the same title already exists"}, status=status.HTTP_400_BAD_REQUEST)
+
+    response_status = status.HTTP_201_CREATED if tasks else status.HTTP_400_BAD_REQUEST
+    return Response({"created":self.serializer_class(tasks, many=True).data,
+                     "errors":[{"index":index, "errors":errors[index]} for index in sorted(errors)]
+                    }, status=response_status
+                   )
+
+
+
+class BulkUpdateTaskAPIView(GenericAPIView):
+
+  permission_classes = [IsAuthenticated]
+  serializer_class = TaskBulkSerializer
+  throttle_scope = 'bulk'
+  throttle_cost  = 10   # up to TASK_BULK_MAX_ITEMS rows
+
+  def put(self,request):
+    items = request.data
+    try:
+      bulk.check_batch_size(items)
+    except bulk.BulkRequestError as e:
+      return Response({"message":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    errors = {}
+    ids    = {}
+    seen_ids = set()
+    for index, item in enumerate(items):
+      task_id = bulk.parse_id(item.get('id')) if isinstance(item, dict) else None
+      if task_id is None:
+        errors[index] = {"id":"A valid task id is required"}
+      elif task_id in seen_ids:
+        errors[index] = {"id":"Task appears more than once in the request"}
+      else:
+        ids[index] = task_id
+        seen_ids.add(task_id)
+
+    tasks = TaskModel.objects.in_bulk(ids.values())
+
+    valid = []
+    for index, task_id in ids.items():
+      task = tasks.get(task_id)
+
+      if not task:
+        errors[index] = {"message":"Task not found"}
+        continue
+
+      if not request.user.is_staff and task.owner_id != request.user.id:
+        errors[index] = {"message":"Illegal access"}
+        continue
+
+      serializer = self.serializer_class(task, data=items[index], partial=True, context={'request':request})
+      if not serializer.is_valid():
+        errors[index] = serializer.errors
+        continue
+
+      owner_id = task.owner_id
+      if request.user.is_staff and 'owner' in items[index]:
+        owner_id = bulk.requested_owner_id(request, items[index])
+
+      valid.append((index, task, serializer.validated_data, owner_id))
+
+
+    owner_ids = bulk.existing_owner_ids(owner_id for index, task, data, owner_id in valid if owner_id != task.owner_id)
+
+    renamed = [(index, task, data, owner_id) for index, task, data, owner_id in valid
+               if owner_id != task.owner_id or data.get('title', task.title) != task.title
+              ]
+    taken = bulk.existing_titles((owner_id, data.get('title', task.title)) for index, task, data, owner_id in renamed)
+
+    seen = set()
+    for index, task, data, owner_id in renamed:
+      if owner_id != task.owner_id and owner_id not in owner_ids:
+        errors[index] = {"owner":"User with this ID does not exist"}
+        continue
+
+      key = (owner_id, data.get('title', task.title))
+      if taken.get(key, task.id) != task.id or key in seen:
+        errors[index] = {"title":"A task with the same title already exists"}
+        continue
+      seen.add(key)
+
+
+    now     = timezone.now()
+    updated = []
+    changes = []
+    buckets = []
+    groups  = {}   # tasks grouped by the columns they change, so no column is written that wasn't sent
+    for index, task, data, owner_id in valid:
+      if index in errors:
+        continue
+
+      fields = set(data) | {'updated_at'}
+      if owner_id != task.owner_id:
+        fields.add('owner')
+        changes.append((DELETED, task.id, task.owner_id))
+      changes.append((UPDATED, task.id, owner_id))
+
+      if 'due_date' in data and not data['due_date']:
+        data['due_date'] = default_due_date()   # as TaskModel.save does for a single update
+
+      before = task.counted_bucket()
+      for attr, value in data.items():
+        setattr(task, attr, value)
+      task.owner_id   = owner_id
+      task.updated_at = now   # bulk_update skips auto_now
+      buckets += bucket_deltas(before, task.counted_bucket())
+
+      fields = tuple(sorted(fields))
+      groups.setdefault(fields, []).append(task)
+      updated.append(task)
+
+
+    if updated:
+      try:
+        with transaction.atomic():
+          for fields, group in groups.items():
+            TaskModel.objects.bulk_update(group, fields)
+          tasks_changed.send(sender=TaskModel, changes=changes, buckets=buckets)
+      except IntegrityError:
+        return Response({"detail":"A task with the same title already exists"}, status=status.HTTP_400_BAD_REQUEST)
+
+    response_status = status.HTTP_200_OK if updated else status.HTTP_400_BAD_REQUEST
+    return Response({"updated":self.serializer_class(updated, many=True).data,
+                     "errors":[{"index":index, "errors":errors[index]} for index in sorted(errors)]
+                    }, status=response_status
+                   )
+
+
+
+class BulkDeleteTaskAPIView(GenericAPIView):
+
+  permission_classes = [IsAuthenticated]
+  throttle_scope = 'bulk'
+  throttle_cost  = 10
+
+  def delete(self,request):
+    items = request.data.get('ids') if isinstance(request.data, dict) else None
+    try:
+      bulk.check_batch_size(items)
+    except bulk.BulkRequestError as e:
+      return Response({"message":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = [bulk.parse_id(task_id) for task_id in items]
+    buckets = {task_id:(owner_id, task_status, due_date)   # (owner_id, status, due_date), the owner check and the stats summary read them
+               for task_id, owner_id, task_status, due_date in TaskModel.objects.filter(id__in=[task_id for task_id in ids if task_id is not None])
+                                                                                 .values_list('id','owner_id','status','due_date')
+              }
+
+    errors  = {}
+    allowed = {}   # task id -> index, in request order
+    for index, task_id in enumerate(ids):
+      if task_id not in buckets:
+        errors[index] = {"message":"Task not found"}
+      elif not request.user.is_staff and buckets[task_id][0] != request.user.id:
+        errors[index] = {"message":"Illegal access"}
+      elif task_id in allowed:
+        errors[index] = {"id":"Task appears more than once in the request"}
+      else:
+        allowed[task_id] = index
+
+    deleted = []
+    if allowed:
+      with transaction.atomic():
+        removed = bulk.delete_tasks(allowed)
+        deleted = [task_id for task_id in allowed if task_id in removed]
+        tasks_changed.send(sender=TaskModel, changes=[(DELETED, task_id, removed[task_id][0]) for task_id in deleted],
+                           buckets=[(*removed[task_id], -1) for task_id in deleted])
+
+      for task_id in allowed.keys() - removed.keys():   # deleted by someone else since the read above
+        errors[allowed[task_id]] = {"message":"Task not found"}
+
+    response_status = status.HTTP_200_OK if deleted else status.HTTP_400_BAD_REQUEST
+    return Response({"deleted":deleted,
+                     "errors":[{"index":index, "errors":errors[index]} for index in sorted(errors)]
+                    }, status=response_status
+                   )
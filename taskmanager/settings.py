@@ -53,7 +53,9 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'api.metrics.performance_middleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.routers.replica_pinning_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -93,9 +95,88 @@ DATABASES = {
         'PASSWORD': '1234',
         'HOST': 'localhost',
         'PORT': '5432',
+        # persistent connections by default, or a psycopg connection pool with DB_POOL=True (needed under ASGI)
+        'CONN_MAX_AGE': 0 if os.getenv("DB_POOL") == "True" else int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+                'max_size': int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                'timeout': int(os.getenv("DB_POOL_TIMEOUT", 10)),
+            },
+        } if os.getenv("DB_POOL") == "True" else {},
     }
 }
 
+# read replicas, one alias per host in DATABASE_REPLICA_HOSTS, see api.routers
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.getenv("DATABASE_REPLICA_HOSTS", "").split(",")), start=1):
+    DATABASES[f'replica_{number}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['api.routers.PrimaryReplicaRouter']
+
+# seconds a client keeps reading from the primary after a write, longer than the replicas usually lag.
+# the pin is kept in the cache, so replicas need REDIS_URL too
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DATABASE_REPLICA_PIN_SECONDS", 5))
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# local memory by default, set REDIS_URL to share the cache between processes in production
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# seconds a user's active/staff flags are cached by the JWT authentication, saving the user drops them earlier.
+# needs the shared cache, a save in one process can't reach another's local memory
+AUTH_USER_STATE_TIMEOUT = int(os.getenv("AUTH_USER_STATE_TIMEOUT", 60 if os.getenv("REDIS_URL") else 0))
+
+# seconds a cached task response is kept, writes invalidate it earlier. 0 turns the response cache off.
+# needs the shared cache too, another process would keep serving its local copy after a write
+TASK_CACHE_TIMEOUT = int(os.getenv("TASK_CACHE_TIMEOUT", 300 if os.getenv("REDIS_URL") else 0))
+
+
+# per view timing histograms at /api/metrics/ and Server-Timing headers, see api.metrics
+PERFORMANCE_METRICS = os.getenv("PERFORMANCE_METRICS", "True") == "True"
+
+# when set, /api/metrics/ answers only requests with "Authorization: Bearer <METRICS_TOKEN>", otherwise only staff sessions
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# request queries slower than this many milliseconds are logged with their SQL by api.performance, 0 turns it off
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", 200))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+        'api.jobs': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
@@ -125,6 +206,32 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# algorithm of new and upgraded password hashes: argon2 (needs argon2-cffi), scrypt or pbkdf2.
+# the others stay listed so existing hashes still verify, and are replaced on the user's next login
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "argon2")
+
+_PASSWORD_HASHERS = {"argon2": "api.hashers.Argon2PasswordHasher",
+                     "scrypt": "api.hashers.ScryptPasswordHasher",
+                     "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+                    }
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER],
+                    *(path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER)]
+
+# argon2id costs, the defaults are OWASP's minimum (19 MiB, 2 passes, 1 lane), about 30 ms a hash
+PASSWORD_ARGON2_TIME_COST   = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", 19456))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", 1))
+
+# scrypt costs, the defaults are django's (N=2^14, r=8, p=5)
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv("PASSWORD_SCRYPT_WORK_FACTOR", 2 ** 14))
+PASSWORD_SCRYPT_BLOCK_SIZE  = int(os.getenv("PASSWORD_SCRYPT_BLOCK_SIZE", 8))
+PASSWORD_SCRYPT_PARALLELISM = int(os.getenv("PASSWORD_SCRYPT_PARALLELISM", 5))
+
+# password hashes computed at once per process, and seconds a login or registration waits
+# for a turn before it gets a 503
+PASSWORD_HASHING_CONCURRENCY = int(os.getenv("PASSWORD_HASHING_CONCURRENCY", 2))
+PASSWORD_HASHING_TIMEOUT     = float(os.getenv("PASSWORD_HASHING_TIMEOUT", 5))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/6.0/topics/i18n/
@@ -141,11 +248,71 @@ USE_TZ = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination"
+    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+
+    # sliding window budgets on the cache, see api.throttling. a view spends throttle_cost
+    # tokens per request, login and register 10, bulk writes 10, exports 20, stats 5, so
+    # e.g. login_username allows 5 attempts a minute against one account
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.IPRateThrottle',
+        'api.throttling.UserRateThrottle',
+        'api.throttling.EndpointRateThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'ip': os.getenv("THROTTLE_RATE_IP", "1200/min"),
+        'user': os.getenv("THROTTLE_RATE_USER", "600/min"),
+        'auth': os.getenv("THROTTLE_RATE_AUTH", "300/min"),
+        'login_username': os.getenv("THROTTLE_RATE_LOGIN_USERNAME", "50/min"),
+        'export': os.getenv("THROTTLE_RATE_EXPORT", "600/hour"),
+        'bulk': os.getenv("THROTTLE_RATE_BULK", "600/min"),
+    },
+    # reverse proxies in front of the app. the ip budget is kept per X-Forwarded-For entry this far from the right,
+    # which the last proxy appended, and per REMOTE_ADDR when 0, since a client can send any X-Forwarded-For it likes
+    'NUM_PROXIES': int(os.getenv("NUM_PROXIES", 0)),
 }
 
+# off switch for every throttle above, e.g. for benchmarks
+THROTTLING_ENABLED = os.getenv("THROTTLING_ENABLED", "True") == "True"
+
+
+# largest number of tasks accepted by a single bulk create/update/delete request
+TASK_BULK_MAX_ITEMS = int(os.getenv("TASK_BULK_MAX_ITEMS", 500))
+
+# largest number of changes returned by one page of the sync feed
+TASK_SYNC_MAX_CHANGES = int(os.getenv("TASK_SYNC_MAX_CHANGES", 500))
+
+# sync cursors older than this many days are refused, the change log is pruned a day behind them
+TASK_SYNC_CURSOR_DAYS = int(os.getenv("TASK_SYNC_CURSOR_DAYS", 30))
+
+# rows fetched per round trip while streaming a task export
+TASK_EXPORT_CHUNK_SIZE = int(os.getenv("TASK_EXPORT_CHUNK_SIZE", 2000))
+
+# keep per owner task counts in TaskSummary and serve the stats endpoint from them,
+# run `python manage.py rebuild_task_summary` once after turning it on
+TASK_STATS_SUMMARY = os.getenv("TASK_STATS_SUMMARY") == "True"
+
+
+# background jobs, run by `python manage.py run_jobs`, see api.jobs
+JOB_MAX_ATTEMPTS      = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BACKOFF     = int(os.getenv("JOB_RETRY_BACKOFF", 30))   # seconds before the first retry, doubled for every further one
+JOB_RETRY_BACKOFF_MAX = int(os.getenv("JOB_RETRY_BACKOFF_MAX", 3600))
+JOB_TIMEOUT           = int(os.getenv("JOB_TIMEOUT", 900))        # seconds after which a running job is assumed lost and run again
+JOB_KEEP_DAYS         = int(os.getenv("JOB_KEEP_DAYS", 7))        # finished jobs are deleted after this many days
+
+# job name -> seconds between two runs
+JOB_SCHEDULES = {"sweep_overdue_tasks": int(os.getenv("OVERDUE_SWEEP_INTERVAL", 3600)),
+                 "prune_tokens": 86400,
+                 "prune_task_changes": 86400,
+                 "prune_jobs": 86400,
+                }
+if TASK_STATS_SUMMARY:
+    JOB_SCHEDULES["rebuild_task_summary"] = 86400
+
+# overdue task notices, printed to the console unless a real backend is configured
+EMAIL_BACKEND      = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "tasks@localhost")
 
 
 SIMPLE_JWT = {